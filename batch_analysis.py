@@ -0,0 +1,241 @@
+import random
+import sys
+import time
+from engine import START_FEN, GameState
+from evaluation import MATERIAL_MG
+
+try:
+	import numpy as np
+except ImportError: # only this module needs numpy, the engine runs without it
+	np = None
+
+
+'''
+many positions at once: boards are packed into an N x 8 x 8 array of piece numbers and attack maps,
+pseudo-legal mobility, material and in check flags come out of whole-array operations. the numbers
+match what GameState gives one position at a time (is_square_attacked, get_all_possible_move, in_check)
+'''
+PIECES = ['--', 'wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PIECE_NUMBERS = {piece: i for i, piece in enumerate(PIECES)}
+KNIGHT_STEPS = ((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1))
+KING_STEPS = ((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1))
+ROOK_DIRECTIONS = ((-1,0), (0,-1), (1,0), (0,1))
+BISHOP_DIRECTIONS = ((-1,-1), (-1,1), (1,-1), (1,1))
+
+
+def require_numpy():
+	if np is None:
+		raise ImportError('batch_analysis needs numpy, pip install numpy')
+
+
+class PackedBoards:
+	def __init__(self, boards, white_to_move, enpassant):
+		self.boards = boards # N x 8 x 8 uint8, index into PIECES
+		self.white_to_move = white_to_move # N bool
+		self.enpassant = enpassant # N int8, row*8 + col of the en passant square or -1
+
+	def __len__(self):
+		return len(self.boards)
+
+
+def pack(positions):
+	'''
+	PackedBoards from GameState objects or fen strings
+	'''
+	require_numpy()
+	positions = list(positions)
+	boards = np.zeros((len(positions), 8, 8), dtype=np.uint8)
+	white_to_move = np.zeros(len(positions), dtype=bool)
+	enpassant = np.full(len(positions), -1, dtype=np.int8)
+	gs = None
+	for i, position in enumerate(positions):
+		if isinstance(position, str):
+			if gs is None:
+				gs = GameState()
+			gs.load_fen(position)
+			position = gs
+		boards[i] = [[PIECE_NUMBERS[piece] for piece in row] for row in position.board]
+		white_to_move[i] = position.white_to_move
+		if position.enpassant_possible != ():
+			enpassant[i] = position.enpassant_possible[0] * 8 + position.enpassant_possible[1]
+	return PackedBoards(boards, white_to_move, enpassant)
+
+
+def shift(squares, d_row, d_col):
+	'''
+	move every square of an N x 8 x 8 array by (d_row, d_col), what falls off the board is dropped
+	'''
+	shifted = np.zeros_like(squares)
+	shifted[:, max(d_row, 0):8 + min(d_row, 0), max(d_col, 0):8 + min(d_col, 0)] = \
+		squares[:, max(-d_row, 0):8 + min(-d_row, 0), max(-d_col, 0):8 + min(-d_col, 0)]
+	return shifted
+
+
+def color_attacks(boards, color):
+	'''
+	(attacked squares, target count per board) for color: attacked is an N x 8 x 8 bool map, the
+	count adds up every square each piece of color attacks or moves to that is not its own piece,
+	pawns excluded since they move differently from how they attack
+	'''
+	first = 1 if color == 'w' else 7
+	empty = boards == 0
+	own = (boards >= first) & (boards < first + 6)
+	attacked = np.zeros(boards.shape, dtype=bool)
+	targets = np.zeros(len(boards), dtype=np.int64)
+	for piece, steps in (('N', KNIGHT_STEPS), ('K', KING_STEPS)):
+		present = boards == PIECE_NUMBERS[color + piece]
+		for d_row, d_col in steps:
+			reached = shift(present, d_row, d_col)
+			attacked |= reached
+			targets += (reached & ~own).sum(axis=(1, 2))
+	queens = boards == PIECE_NUMBERS[color + 'Q']
+	for piece, directions in (('R', ROOK_DIRECTIONS), ('B', BISHOP_DIRECTIONS)):
+		sliders = (boards == PIECE_NUMBERS[color + piece]) | queens
+		for d_row, d_col in directions:
+			ray = sliders
+			for _ in range(7):
+				ray = shift(ray, d_row, d_col)
+				if not ray.any():
+					break
+				attacked |= ray
+				targets += (ray & ~own).sum(axis=(1, 2))
+				ray = ray & empty # only an empty square lets the ray go on
+	pawns = boards == PIECE_NUMBERS[color + 'p']
+	forward = -1 if color == 'w' else 1
+	attacked |= shift(pawns, forward, -1) | shift(pawns, forward, 1)
+	return attacked, targets
+
+
+def pawn_moves(boards, color, enpassant):
+	'''
+	pawn pushes, captures and en passant per board, as get_pawn_move generates them
+	'''
+	pawns = boards == PIECE_NUMBERS[color + 'p']
+	empty = boards == 0
+	forward = -1 if color == 'w' else 1
+	enemy_first = 7 if color == 'w' else 1
+	enemy = (boards >= enemy_first) & (boards < enemy_first + 6)
+	single = shift(pawns, forward, 0) & empty
+	start_row = 5 if color == 'w' else 2 # row a single push from the start lands on
+	double = np.zeros_like(single)
+	double[:, start_row + forward] = shift(single, forward, 0)[:, start_row + forward] & empty[:, start_row + forward]
+	ep = np.zeros(boards.shape, dtype=bool)
+	rows = np.nonzero(enpassant >= 0)[0]
+	ep.reshape(len(boards), 64)[rows, enpassant[rows]] = True
+	moves = single.sum(axis=(1, 2)) + double.sum(axis=(1, 2))
+	for d_col in (-1, 1):
+		reached = shift(pawns, forward, d_col)
+		moves += (reached & (enemy | ep)).sum(axis=(1, 2))
+	return moves
+
+
+def analyse(packed):
+	'''
+	dict of arrays over the batch:
+	white_attacks, black_attacks  N x 64 bool, squares attacked by that color
+	mobility                      N, pseudo-legal moves of the side to move, len(get_all_possible_move())
+	in_check                      N bool, side to move in check
+	piece_counts                  N x 13, pieces of each kind indexed like PIECES
+	material                      N, white minus black middlegame material
+	'''
+	require_numpy()
+	boards = packed.boards
+	count = len(boards)
+	white_attacks, white_targets = color_attacks(boards, 'w')
+	black_attacks, black_targets = color_attacks(boards, 'b')
+	to_move = packed.white_to_move
+	# en passant only belongs to the side to move
+	white_ep = np.where(to_move, packed.enpassant, -1)
+	black_ep = np.where(to_move, -1, packed.enpassant)
+	mobility = np.where(to_move, white_targets + pawn_moves(boards, 'w', white_ep), black_targets + pawn_moves(boards, 'b', black_ep))
+	kings = np.where(to_move[:, None, None], boards == PIECE_NUMBERS['wK'], boards == PIECE_NUMBERS['bK'])
+	enemy_attacks = np.where(to_move[:, None, None], black_attacks, white_attacks)
+	in_check = (kings & enemy_attacks).any(axis=(1, 2))
+	piece_counts = np.stack([(boards == i).sum(axis=(1, 2)) for i in range(len(PIECES))], axis=1)
+	values = np.array([0] + [MATERIAL_MG[piece[1]] if piece[0] == 'w' else -MATERIAL_MG[piece[1]] for piece in PIECES[1:]])
+	return {
+		'white_attacks': white_attacks.reshape(count, 64),
+		'black_attacks': black_attacks.reshape(count, 64),
+		'mobility': mobility,
+		'in_check': in_check,
+		'piece_counts': piece_counts,
+		'material': piece_counts @ values,
+	}
+
+
+def analyse_positions(positions):
+	'''
+	pack and analyse in one call
+	'''
+	return analyse(pack(positions))
+
+
+def reference(gs):
+	'''
+	the same numbers for one position from the per-position engine, for cross-checks
+	'''
+	white_attacks = [gs.is_square_attacked(sq // 8, sq % 8, 'w') for sq in range(64)]
+	black_attacks = [gs.is_square_attacked(sq // 8, sq % 8, 'b') for sq in range(64)]
+	material = sum(MATERIAL_MG[piece[1]] * (1 if piece[0] == 'w' else -1) for row in gs.board for piece in row if piece != '--')
+	return {
+		'white_attacks': white_attacks,
+		'black_attacks': black_attacks,
+		'mobility': len(gs.get_all_possible_move()),
+		'in_check': gs.in_check(),
+		'material': material,
+	}
+
+
+def random_positions(count, seed=0, max_ply=120):
+	'''
+	positions from seeded random games, for checks and timing
+	'''
+	rng = random.Random(seed)
+	gs = GameState()
+	fens = []
+	while len(fens) < count:
+		gs.load_fen(START_FEN)
+		for _ in range(rng.randrange(max_ply)):
+			moves = gs.get_valid_move()
+			if not moves:
+				break
+			gs.make_move(rng.choice(moves))
+		fens.append(gs.get_fen())
+	return fens
+
+
+def compare(fens):
+	'''
+	analyse the batch and check every number against the per-position engine
+	'''
+	results = analyse_positions(fens)
+	gs = GameState()
+	for i, fen in enumerate(fens):
+		gs.load_fen(fen)
+		expected = reference(gs)
+		for name, value in expected.items():
+			got = results[name][i].tolist()
+			if got != value:
+				raise AssertionError(f'{name} differs on {fen}: {got} != {value}')
+	return len(fens)
+
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	fens = random_positions(count)
+	print(f'{compare(fens)} positions agree with GameState')
+	packed = pack(fens)
+	start = time.perf_counter()
+	analyse(packed)
+	batch_seconds = time.perf_counter() - start
+	gs = GameState()
+	start = time.perf_counter()
+	for fen in fens:
+		gs.load_fen(fen)
+		reference(gs)
+	loop_seconds = time.perf_counter() - start
+	print(f'batch {count / batch_seconds:.0f} positions/s, per position loop {count / loop_seconds:.0f} positions/s')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,292 @@
+import os
+import sys
+import time
+import tracemalloc
+from engine import ZOBRIST_BLACK_TO_MOVE, ZOBRIST_CASTLE, ZOBRIST_ENPASSANT, ZOBRIST_PIECES, CastleRights, GameState, Move
+from evaluation import PHASE, PST_EG, PST_MG
+import perft
+
+
+# a middlegame with plenty of sliding piece moves
+MIDDLEGAME_LINE = 'e2e4 e7e5 g1f3 b8c6 f1c4 g8f6 d2d3 f8c5 c2c3 d7d6 b1d2 a7a6 e1g1 e8g8'
+
+
+class LegacyMove:
+	'''
+	the Move layout before __slots__: per-instance __dict__ and an eager decimal move_id
+	'''
+	def __init__(self, start_sq, end_sq, board, is_enpassant_move=False, is_castle_move=False):
+		self.start_row = start_sq[0]
+		self.start_col = start_sq[1]
+		self.end_row = end_sq[0]
+		self.end_col = end_sq[1]
+		self.piece_moved = board[self.start_row][self.start_col]
+		self.piece_captured = board[self.end_row][self.end_col]
+		self.is_pawn_promotion = (self.piece_moved == 'wp' and self.end_row == 0) or (self.piece_moved == 'bp' and self.end_row == 7)
+		self.is_enpassant_move = is_enpassant_move
+		if self.is_enpassant_move:
+			self.piece_captured = 'wp' if self.piece_moved =='bp' else 'bp'
+		self.is_castle_move = is_castle_move
+		self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+
+
+class LegacyUndoGameState(GameState):
+	'''
+	make/undo before the preallocated undo stack: every ply appends a fresh CastleRights and one entry
+	to each state log, undo pops them and works the en passant square out from the previous move
+	'''
+	def __init__(self, move_cache=None):
+		super().__init__(move_cache)
+		self.start_logs()
+
+	def load_fen(self, fen):
+		super().load_fen(fen)
+		self.start_logs()
+
+	def start_logs(self):
+		rights = self.current_castling_right
+		self.castle_rights_log = [CastleRights(rights.wks, rights.bks, rights.wqs, rights.bqs)]
+		self.zobrist_log = []
+		self.halfmove_clock_log = []
+		self.eval_log = []
+		self.start_enpassant_possible = self.enpassant_possible
+
+	def make_move(self, move):
+		piece = move.piece_moved
+		placed = piece[0]+'Q' if move.is_pawn_promotion else piece
+		start_sq = move.start_row*8 + move.start_col
+		end_sq = move.end_row*8 + move.end_col
+		key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[piece][start_sq] ^ ZOBRIST_PIECES[placed][end_sq]
+		mg = self.eval_mg - PST_MG[piece][start_sq] + PST_MG[placed][end_sq]
+		eg = self.eval_eg - PST_EG[piece][start_sq] + PST_EG[placed][end_sq]
+		phase = self.eval_phase + PHASE[placed] - PHASE[piece]
+		if move.piece_captured != '--':
+			captured_sq = move.start_row*8 + move.end_col if move.is_enpassant_move else end_sq
+			key ^= ZOBRIST_PIECES[move.piece_captured][captured_sq]
+			mg -= PST_MG[move.piece_captured][captured_sq]
+			eg -= PST_EG[move.piece_captured][captured_sq]
+			phase -= PHASE[move.piece_captured]
+		enpassant_col = self.zobrist_enpassant_col()
+		if enpassant_col is not None:
+			key ^= ZOBRIST_ENPASSANT[enpassant_col]
+		key ^= ZOBRIST_CASTLE[self.current_castling_right.to_bits()]
+		self.zobrist_log.append(self.zobrist_key)
+		self.eval_log.append((self.eval_mg, self.eval_eg, self.eval_phase))
+
+		self.board[move.start_row][move.start_col] = '--'
+		self.board[move.end_row][move.end_col] = placed
+		self.move_log.append(move)
+		self.white_to_move = not self.white_to_move
+		if piece == 'wK':
+			self.white_king_location = (move.end_row, move.end_col)
+		elif piece == 'bK':
+			self.black_king_location = (move.end_row, move.end_col)
+		if move.is_enpassant_move:
+			self.board[move.start_row][move.end_col] = '--'
+		if piece[1] == 'p' and abs(move.start_row - move.end_row) == 2:
+			self.enpassant_possible = ((move.start_row + move.end_row)//2, move.start_col)
+		else:
+			self.enpassant_possible = ()
+		if move.is_castle_move:
+			if move.end_col - move.start_col == 2:
+				rook_col, rook_end_col = move.end_col+1, move.end_col-1
+			else:
+				rook_col, rook_end_col = move.end_col-2, move.end_col+1
+			rook = self.board[move.end_row][rook_col]
+			self.board[move.end_row][rook_end_col] = rook
+			self.board[move.end_row][rook_col] = '--'
+			if rook != '--':
+				rook_sq = move.end_row*8 + rook_col
+				rook_end_sq = move.end_row*8 + rook_end_col
+				key ^= ZOBRIST_PIECES[rook][rook_sq] ^ ZOBRIST_PIECES[rook][rook_end_sq]
+				mg += PST_MG[rook][rook_end_sq] - PST_MG[rook][rook_sq]
+				eg += PST_EG[rook][rook_end_sq] - PST_EG[rook][rook_sq]
+
+		self.update_castle_rights(move)
+		rights = self.current_castling_right
+		self.castle_rights_log.append(CastleRights(rights.wks, rights.bks, rights.wqs, rights.bqs))
+		key ^= ZOBRIST_CASTLE[rights.to_bits()]
+		enpassant_col = self.zobrist_enpassant_col()
+		if enpassant_col is not None:
+			key ^= ZOBRIST_ENPASSANT[enpassant_col]
+		self.zobrist_key = key
+		self.eval_mg = mg
+		self.eval_eg = eg
+		self.eval_phase = phase
+		self.repetition_counts[key] = self.repetition_counts.get(key, 0) + 1
+
+		self.halfmove_clock_log.append(self.halfmove_clock)
+		if piece[1] == 'p' or move.piece_captured != '--':
+			self.halfmove_clock = 0
+		else:
+			self.halfmove_clock += 1
+		if piece[0] == 'b':
+			self.fullmove_number += 1
+
+	def undo_move(self):
+		if len(self.move_log) != 0:
+			move = self.move_log.pop()
+			self.board[move.start_row][move.start_col] = move.piece_moved
+			self.board[move.end_row][move.end_col] = move.piece_captured
+			self.white_to_move = not self.white_to_move
+			if move.piece_moved == 'wK':
+				self.white_king_location = (move.start_row, move.start_col)
+			elif move.piece_moved == 'bK':
+				self.black_king_location = (move.start_row, move.start_col)
+			if move.is_enpassant_move:
+				self.board[move.end_row][move.end_col] = '--'
+				self.board[move.start_row][move.end_col] = move.piece_captured
+			count = self.repetition_counts[self.zobrist_key] - 1
+			if count:
+				self.repetition_counts[self.zobrist_key] = count
+			else:
+				del self.repetition_counts[self.zobrist_key]
+			# en passant square only depends on the move before, so take it from there
+			self.enpassant_possible = self.start_enpassant_possible
+			if len(self.move_log) != 0:
+				self.enpassant_possible = ()
+				last_move = self.move_log[-1]
+				if last_move.piece_moved[1] == 'p' and abs(last_move.start_row - last_move.end_row) == 2:
+					self.enpassant_possible = ((last_move.start_row + last_move.end_row)//2, last_move.start_col)
+			self.castle_rights_log.pop()
+			last_rights = self.castle_rights_log[-1]
+			self.current_castling_right = CastleRights(last_rights.wks, last_rights.bks, last_rights.wqs, last_rights.bqs)
+			if move.is_castle_move:
+				if move.end_col - move.start_col == 2:
+					self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-1]
+					self.board[move.end_row][move.end_col-1] = '--'
+				else:
+					self.board[move.end_row][move.end_col-2] = self.board[move.end_row][move.end_col+1]
+					self.board[move.end_row][move.end_col+1] = '--'
+			self.zobrist_key = self.zobrist_log.pop()
+			self.eval_mg, self.eval_eg, self.eval_phase = self.eval_log.pop()
+			self.halfmove_clock = self.halfmove_clock_log.pop()
+			if move.piece_moved[0] == 'b':
+				self.fullmove_number -= 1
+
+
+def best_time(function, repeat=5):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+def allocated_bytes(function):
+	'''
+	bytes still held by whatever function returns, measured with tracemalloc
+	'''
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	result = function()
+	after = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	del result
+	return after - before
+
+
+def bench_move():
+	'''
+	allocation and time of Move against the old dict based layout, alone and inside get_valid_move
+	'''
+	import engine
+	gs = GameState()
+	perft.play_moves(gs, MIDDLEGAME_LINE)
+	board = gs.board
+	count = 100000
+	print(f'move encoding, {count} moves built on a middlegame board')
+	for name, cls in (('dict Move', LegacyMove), ('slots Move', Move)):
+		per_move = allocated_bytes(lambda: [cls((7,5), (3,1), board) for _ in range(count)]) / count
+		seconds = best_time(lambda: [cls((7,5), (3,1), board) for _ in range(count)])
+		print(f'  {name:12} {per_move:7.1f} bytes/move {seconds / count * 1e9:8.1f} ns/move')
+
+	print('get_valid_move on the same board, 2000 calls')
+	for name, cls in (('dict Move', LegacyMove), ('slots Move', Move)):
+		engine.Move = cls # generators look the name up in the module at call time
+		try:
+			seconds = best_time(lambda: [gs.get_valid_move() for _ in range(2000)])
+		finally:
+			engine.Move = Move
+		print(f'  {name:12} {seconds / 2000 * 1e6:8.1f} us/call')
+
+
+def bench_make_undo():
+	'''
+	make_move/undo_move pairs per second over every legal move of a few positions, log based
+	undo against the preallocated undo stack
+	'''
+	positions = [fen for fen, _ in perft.REFERENCE_POSITIONS.values()]
+	rounds = 2000
+	for name, cls in (('undo logs', LegacyUndoGameState), ('undo stack', GameState)):
+		gs = cls()
+		jobs = []
+		for fen in positions:
+			gs.load_fen(fen)
+			jobs.append((fen, gs.get_valid_move()))
+		pairs = rounds * sum(len(moves) for _, moves in jobs)
+
+		def run():
+			make_move = gs.make_move
+			undo_move = gs.undo_move
+			for fen, moves in jobs:
+				gs.load_fen(fen)
+				for _ in range(rounds):
+					for move in moves:
+						make_move(move)
+						undo_move()
+
+		seconds = best_time(run, repeat=3)
+		print(f'make/undo {name:10}: {pairs} pairs in {seconds:.3f}s, {pairs / seconds:.0f} pairs/s')
+
+
+def bench_parallel():
+	'''
+	root split perft and a best move batch on 1..N worker processes
+	'''
+	import parallel
+	max_processes = int(os.environ.get('BENCH_PROCESSES', os.cpu_count()))
+	gs = GameState()
+	gs.load_fen(perft.REFERENCE_POSITIONS['kiwipete'][0])
+	print(f'kiwipete perft 3 over 1..{max_processes} processes')
+	for processes, seconds, speedup in parallel.scaling(lambda n: parallel.parallel_perft(gs, 3, n), max_processes):
+		print(f'  {processes:3} processes {seconds:8.3f}s speedup {speedup:5.2f}x')
+	fens = [fen for fen, _ in perft.REFERENCE_POSITIONS.values()] * 4
+	print(f'{len(fens)} positions best move at depth 3 over 1..{max_processes} processes')
+	for processes, seconds, speedup in parallel.scaling(lambda n: parallel.batch_best_moves(fens, max_depth=3, processes=n), max_processes):
+		print(f'  {processes:3} processes {seconds:8.3f}s speedup {speedup:5.2f}x')
+
+
+def bench_instrumentation():
+	'''
+	perft 3 from the start with instrumentation never enabled, enabled, and enabled then disabled again
+	'''
+	import instrumentation
+	gs = GameState()
+	plain = best_time(lambda: perft.perft(gs, 3), repeat=3)
+	with instrumentation.instrumented() as metrics:
+		enabled = best_time(lambda: perft.perft(gs, 3), repeat=3)
+	disabled = best_time(lambda: perft.perft(gs, 3), repeat=3)
+	print(f'perft 3: plain {plain:.3f}s, instrumented {enabled:.3f}s ({enabled / plain:.2f}x), disabled again {disabled:.3f}s ({disabled / plain:.2f}x)')
+	for name, data in metrics.snapshot()['histograms'].items():
+		print(f'  {name:32} {data["count"]:9} calls {data["mean"] * 1e6:9.1f} us/call')
+
+
+BENCHMARKS = {
+	'move': bench_move,
+	'make_undo': bench_make_undo,
+	'parallel': bench_parallel,
+	'instrumentation': bench_instrumentation,
+}
+
+
+def main():
+	names = sys.argv[1:] or list(BENCHMARKS)
+	for name in names:
+		BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+	main()
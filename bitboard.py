@@ -0,0 +1,396 @@
+from engine import CastleRights, GameState, Move, parse_fen
+
+
+'''
+bitboard backend: square index is row*8 + col, so bit 0 is a8 (row 0, col 0) and bit 63 is h1
+'''
+ALL_SQUARES = (1 << 64) - 1
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+
+# directions that increase the square index scan for their lowest blocker, the others for their highest
+POSITIVE_DIRECTIONS = ((0,1), (1,0), (1,1), (1,-1))
+NEGATIVE_DIRECTIONS = ((0,-1), (-1,0), (-1,-1), (-1,1))
+ROOK_DIRECTIONS = ((0,1), (1,0), (0,-1), (-1,0))
+BISHOP_DIRECTIONS = ((1,1), (1,-1), (-1,-1), (-1,1))
+
+
+def _step_table(steps):
+	table = []
+	for sq in range(64):
+		row, col = divmod(sq, 8)
+		bb = 0
+		for d in steps:
+			end_row = row + d[0]
+			end_col = col + d[1]
+			if 0 <= end_row < 8 and 0 <= end_col < 8:
+				bb |= 1 << (end_row*8 + end_col)
+		table.append(bb)
+	return table
+
+
+def _ray_table():
+	rays = {}
+	for d in POSITIVE_DIRECTIONS + NEGATIVE_DIRECTIONS:
+		rays[d] = []
+		for sq in range(64):
+			row, col = divmod(sq, 8)
+			bb = 0
+			end_row, end_col = row + d[0], col + d[1]
+			while 0 <= end_row < 8 and 0 <= end_col < 8:
+				bb |= 1 << (end_row*8 + end_col)
+				end_row += d[0]
+				end_col += d[1]
+			rays[d].append(bb)
+	return rays
+
+
+KNIGHT_ATTACKS = _step_table(((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1)))
+KING_ATTACKS = _step_table(((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1)))
+# squares a pawn of that color attacks from sq, white pawns capture towards row 0
+PAWN_ATTACKS = {'w': _step_table(((-1,-1), (-1,1))), 'b': _step_table(((1,-1), (1,1)))}
+RAYS = _ray_table()
+
+# BETWEEN[a][b]: squares strictly between two aligned squares, LINE[a][b]: whole line through both
+BETWEEN = [[0] * 64 for _ in range(64)]
+LINE = [[0] * 64 for _ in range(64)]
+for _sq in range(64):
+	for _d in POSITIVE_DIRECTIONS + NEGATIVE_DIRECTIONS:
+		_opposite = (-_d[0], -_d[1])
+		_between = 0
+		_ray = RAYS[_d][_sq]
+		while _ray:
+			_lsb = _ray & -_ray if _d in POSITIVE_DIRECTIONS else 1 << (_ray.bit_length() - 1)
+			_target = _lsb.bit_length() - 1
+			BETWEEN[_sq][_target] = _between
+			LINE[_sq][_target] = RAYS[_d][_sq] | RAYS[_opposite][_sq] | (1 << _sq)
+			_between |= _lsb
+			_ray ^= _lsb
+
+
+def slider_attacks(sq, occupied, directions):
+	'''
+	classical ray lookup: take the precomputed ray and cut it behind the first blocker
+	'''
+	attacks = 0
+	for rays, positive in directions:
+		ray = rays[sq]
+		blockers = ray & occupied
+		if blockers:
+			if positive:
+				ray ^= rays[(blockers & -blockers).bit_length() - 1]
+			else:
+				ray ^= rays[blockers.bit_length() - 1]
+		attacks |= ray
+	return attacks
+
+
+# (ray table, scans for lowest blocker) per direction, what slider_attacks walks
+ROOK_RAYS = tuple((RAYS[d], d in POSITIVE_DIRECTIONS) for d in ROOK_DIRECTIONS)
+BISHOP_RAYS = tuple((RAYS[d], d in POSITIVE_DIRECTIONS) for d in BISHOP_DIRECTIONS)
+QUEEN_RAYS = ROOK_RAYS + BISHOP_RAYS
+
+
+def rook_attacks(sq, occupied):
+	return slider_attacks(sq, occupied, ROOK_RAYS)
+
+
+def bishop_attacks(sq, occupied):
+	return slider_attacks(sq, occupied, BISHOP_RAYS)
+
+
+def squares(bb):
+	'''
+	yield the index of every set bit, lowest first
+	'''
+	while bb:
+		lsb = bb & -bb
+		yield lsb.bit_length() - 1
+		bb ^= lsb
+
+
+#################################################################################
+class BitboardGameState:
+	'''
+	same get_valid_move / make_move / undo_move interface as engine.GameState, but move
+	generation and attack tests run on one 64-bit integer per piece type and colour.
+	board is kept as a mailbox so Move objects and main.py keep working unchanged
+	'''
+	def __init__(self):
+		self.board = [
+			['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
+			['bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp'],
+			['--', '--', '--', '--', '--', '--', '--', '--'],
+			['--', '--', '--', '--', '--', '--', '--', '--'],
+			['--', '--', '--', '--', '--', '--', '--', '--'],
+			['--', '--', '--', '--', '--', '--', '--', '--'],
+			['wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'],
+			['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']
+		]
+		self.white_to_move = True
+		self.move_log = []
+		self.checkmate = False
+		self.stalemate = False
+		self.enpassant_possible = ()
+		self.enpassant_log = []
+		self.current_castling_right = CastleRights(True, True, True, True)
+		self.castle_rights_log = [CastleRights(True, True, True, True)]
+		self.load_bitboards()
+
+	def load_fen(self, fen):
+		'''
+		replace the whole position with fen, the move counters are not tracked here
+		'''
+		board, white_to_move, castle_rights, enpassant_possible = parse_fen(fen)[:4]
+		self.board = board
+		self.white_to_move = white_to_move
+		self.move_log = []
+		self.checkmate = False
+		self.stalemate = False
+		self.enpassant_possible = enpassant_possible
+		self.enpassant_log = []
+		self.current_castling_right = castle_rights
+		self.castle_rights_log = [CastleRights(castle_rights.wks, castle_rights.bks, castle_rights.wqs, castle_rights.bqs)]
+		self.load_bitboards()
+
+	def load_bitboards(self):
+		'''
+		rebuild every bitboard from self.board
+		'''
+		self.bitboards = {piece: 0 for piece in PIECES}
+		self.occupied = {'w': 0, 'b': 0}
+		for row in range(8):
+			for col in range(8):
+				piece = self.board[row][col]
+				if piece != '--':
+					bit = 1 << (row*8 + col)
+					self.bitboards[piece] |= bit
+					self.occupied[piece[0]] |= bit
+
+	@property
+	def white_king_location(self):
+		return divmod(self.bitboards['wK'].bit_length() - 1, 8)
+
+	@property
+	def black_king_location(self):
+		return divmod(self.bitboards['bK'].bit_length() - 1, 8)
+
+	def put_piece(self, piece, row, col):
+		bit = 1 << (row*8 + col)
+		self.bitboards[piece] |= bit
+		self.occupied[piece[0]] |= bit
+		self.board[row][col] = piece
+
+	def remove_piece(self, piece, row, col):
+		bit = 1 << (row*8 + col)
+		self.bitboards[piece] ^= bit
+		self.occupied[piece[0]] ^= bit
+		self.board[row][col] = '--'
+
+	def make_move(self, move):
+		bb = self.bitboards
+		piece = move.piece_moved
+		captured = move.piece_captured
+		start_bit = 1 << (move.start_row*8 + move.start_col)
+		end_bit = 1 << (move.end_row*8 + move.end_col)
+		if move.is_enpassant_move:
+			self.remove_piece(captured, move.start_row, move.end_col)
+		elif captured != '--':
+			bb[captured] ^= end_bit
+			self.occupied[captured[0]] ^= end_bit
+		placed = piece[0]+'Q' if move.is_pawn_promotion else piece
+		bb[piece] ^= start_bit
+		bb[placed] |= end_bit
+		self.occupied[piece[0]] ^= start_bit | end_bit
+		self.board[move.start_row][move.start_col] = '--'
+		self.board[move.end_row][move.end_col] = placed
+		# castling move, the rook is whatever stands on the corner like in GameState
+		if move.is_castle_move:
+			if move.end_col - move.start_col == 2:
+				rook_col, rook_end_col = move.end_col+1, move.end_col-1
+			else:
+				rook_col, rook_end_col = move.end_col-2, move.end_col+1
+			rook = self.board[move.end_row][rook_col]
+			if rook != '--':
+				self.remove_piece(rook, move.end_row, rook_col)
+				self.put_piece(rook, move.end_row, rook_end_col)
+		self.move_log.append(move)
+		self.enpassant_log.append(self.enpassant_possible)
+		self.white_to_move = not self.white_to_move
+		if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:
+			self.enpassant_possible = ((move.start_row + move.end_row)//2, move.start_col)
+		else:
+			self.enpassant_possible = ()
+		self.update_castle_rights(move)
+		self.castle_rights_log.append(CastleRights(self.current_castling_right.wks, self.current_castling_right.bks,
+											   self.current_castling_right.wqs, self.current_castling_right.bqs))
+
+	def undo_move(self):
+		if len(self.move_log) != 0:
+			move = self.move_log.pop()
+			if move.is_castle_move:
+				if move.end_col - move.start_col == 2:
+					rook_col, rook_end_col = move.end_col+1, move.end_col-1
+				else:
+					rook_col, rook_end_col = move.end_col-2, move.end_col+1
+				rook = self.board[move.end_row][rook_end_col]
+				if rook != '--':
+					self.remove_piece(rook, move.end_row, rook_end_col)
+					self.put_piece(rook, move.end_row, rook_col)
+			bb = self.bitboards
+			piece = move.piece_moved
+			captured = move.piece_captured
+			start_bit = 1 << (move.start_row*8 + move.start_col)
+			end_bit = 1 << (move.end_row*8 + move.end_col)
+			bb[self.board[move.end_row][move.end_col]] ^= end_bit # the piece that landed, a queen after promotion
+			bb[piece] |= start_bit
+			self.occupied[piece[0]] ^= start_bit | end_bit
+			self.board[move.start_row][move.start_col] = piece
+			self.board[move.end_row][move.end_col] = '--'
+			if move.is_enpassant_move:
+				self.put_piece(captured, move.start_row, move.end_col)
+			elif captured != '--':
+				bb[captured] |= end_bit
+				self.occupied[captured[0]] |= end_bit
+				self.board[move.end_row][move.end_col] = captured
+			self.white_to_move = not self.white_to_move
+			self.enpassant_possible = self.enpassant_log.pop()
+			self.castle_rights_log.pop()
+			last_rights = self.castle_rights_log[-1]
+			self.current_castling_right = CastleRights(last_rights.wks, last_rights.bks, last_rights.wqs, last_rights.bqs)
+
+	update_castle_rights = GameState.update_castle_rights
+
+	def attackers_to(self, sq, attacker_color, occupied):
+		'''
+		bitboard of attacker_color pieces hitting sq for the given occupancy
+		'''
+		bb = self.bitboards
+		other_color = 'b' if attacker_color == 'w' else 'w'
+		queens = bb[attacker_color+'Q']
+		return (KNIGHT_ATTACKS[sq] & bb[attacker_color+'N']) | \
+			(KING_ATTACKS[sq] & bb[attacker_color+'K']) | \
+			(PAWN_ATTACKS[other_color][sq] & bb[attacker_color+'p']) | \
+			(rook_attacks(sq, occupied) & (bb[attacker_color+'R'] | queens)) | \
+			(bishop_attacks(sq, occupied) & (bb[attacker_color+'B'] | queens))
+
+	def is_square_attacked(self, row, col, attacker_color):
+		return self.attackers_to(row*8 + col, attacker_color, self.occupied['w'] | self.occupied['b']) != 0
+
+	def square_under_attack(self, row, col):
+		return self.is_square_attacked(row, col, 'b' if self.white_to_move else 'w')
+
+	def in_check(self):
+		ally_color = 'w' if self.white_to_move else 'b'
+		king_sq = self.bitboards[ally_color+'K'].bit_length() - 1
+		return self.attackers_to(king_sq, 'b' if self.white_to_move else 'w', self.occupied['w'] | self.occupied['b']) != 0
+
+	def get_valid_move(self):
+		ally_color, enemy_color = ('w', 'b') if self.white_to_move else ('b', 'w')
+		bb = self.bitboards
+		ally = self.occupied[ally_color]
+		enemy = self.occupied[enemy_color]
+		occupied = ally | enemy
+		king_sq = bb[ally_color+'K'].bit_length() - 1
+		board = self.board
+		move = []
+
+		checkers = self.attackers_to(king_sq, enemy_color, occupied)
+		# pins: enemy sliders that see the king through exactly one of our pieces
+		pin_lines = {}
+		enemy_queens = bb[enemy_color+'Q']
+		snipers = (rook_attacks(king_sq, enemy) & (bb[enemy_color+'R'] | enemy_queens)) | \
+			(bishop_attacks(king_sq, enemy) & (bb[enemy_color+'B'] | enemy_queens))
+		for sniper in squares(snipers):
+			between = BETWEEN[king_sq][sniper] & occupied
+			if between and between & (between - 1) == 0 and between & ally:
+				pin_lines[between.bit_length() - 1] = LINE[king_sq][sniper]
+
+		# king moves, tested with the king lifted off the board so sliders see through it
+		king_row, king_col = divmod(king_sq, 8)
+		occupied_without_king = occupied ^ (1 << king_sq)
+		for end in squares(KING_ATTACKS[king_sq] & ~ally):
+			if not self.attackers_to(end, enemy_color, occupied_without_king):
+				move.append(Move((king_row, king_col), divmod(end, 8), board))
+		if checkers & (checkers - 1): # double check, only the king or a lucky en passant can move
+			target = 0
+		elif checkers:
+			checker_sq = checkers.bit_length() - 1
+			target = BETWEEN[king_sq][checker_sq] | checkers
+		else:
+			target = ALL_SQUARES
+		target &= ~ally
+
+		for start in squares(bb[ally_color+'N']):
+			if start in pin_lines: # a pinned knight can never move
+				continue
+			start_sq = divmod(start, 8)
+			for end in squares(KNIGHT_ATTACKS[start] & target):
+				move.append(Move(start_sq, divmod(end, 8), board))
+		for piece, directions in (('B', BISHOP_RAYS), ('R', ROOK_RAYS), ('Q', QUEEN_RAYS)):
+			for start in squares(bb[ally_color+piece]):
+				attacks = slider_attacks(start, occupied, directions) & target
+				if start in pin_lines:
+					attacks &= pin_lines[start]
+				start_sq = divmod(start, 8)
+				for end in squares(attacks):
+					move.append(Move(start_sq, divmod(end, 8), board))
+
+		self.get_pawn_moves(ally_color, enemy_color, target, pin_lines, occupied, king_sq, move)
+		if not checkers:
+			self.get_castle_moves(king_row, king_col, move)
+		return self.set_game_over(move, checkers != 0)
+
+	def get_pawn_moves(self, ally_color, enemy_color, target, pin_lines, occupied, king_sq, move):
+		board = self.board
+		enemy = self.occupied[enemy_color]
+		forward = -8 if ally_color == 'w' else 8
+		start_row = 6 if ally_color == 'w' else 1
+		ep_sq = self.enpassant_possible[0]*8 + self.enpassant_possible[1] if self.enpassant_possible else -1
+		for start in squares(self.bitboards[ally_color+'p']):
+			row, col = divmod(start, 8)
+			allowed = target & pin_lines.get(start, ALL_SQUARES)
+			one = start + forward
+			if not (occupied >> one) & 1:
+				if (allowed >> one) & 1:
+					move.append(Move((row, col), divmod(one, 8), board))
+				two = one + forward
+				if row == start_row and not (occupied >> two) & 1 and (allowed >> two) & 1:
+					move.append(Move((row, col), divmod(two, 8), board))
+			captures = PAWN_ATTACKS[ally_color][start]
+			for end in squares(captures & enemy & allowed):
+				move.append(Move((row, col), divmod(end, 8), board))
+			if ep_sq >= 0 and (captures >> ep_sq) & 1:
+				# en passant clears two squares on one rank, so test the resulting occupancy directly
+				captured_sq = ep_sq - forward
+				after = (occupied ^ (1 << start) ^ (1 << captured_sq)) | (1 << ep_sq)
+				bb = self.bitboards
+				queens = bb[enemy_color+'Q']
+				if not (rook_attacks(king_sq, after) & (bb[enemy_color+'R'] | queens)) and \
+						not (bishop_attacks(king_sq, after) & (bb[enemy_color+'B'] | queens)) and \
+						not (KNIGHT_ATTACKS[king_sq] & bb[enemy_color+'N']) and \
+						not (PAWN_ATTACKS[ally_color][king_sq] & bb[enemy_color+'p'] & ~(1 << captured_sq)):
+					move.append(Move((row, col), divmod(ep_sq, 8), board, is_enpassant_move=True))
+
+	def get_castle_moves(self, row, col, move):
+		'''
+		same rules as GameState.get_castle_moves, called only when the king is not in check
+		'''
+		rights = self.current_castling_right
+		board = self.board
+		if (self.white_to_move and rights.wks) or (not self.white_to_move and rights.bks):
+			if board[row][col+1] == '--' and board[row][col+2] == '--':
+				if not self.square_under_attack(row, col+1) and not self.square_under_attack(row, col+2):
+					move.append(Move((row, col), (row, col+2), board, is_castle_move=True))
+		if (self.white_to_move and rights.wqs) or (not self.white_to_move and rights.bqs):
+			if board[row][col-1] == '--' and board[row][col-2] == '--' and board[row][col-3] == '--':
+				if not self.square_under_attack(row, col-1) and not self.square_under_attack(row, col-2):
+					move.append(Move((row, col), (row, col-2), board, is_castle_move=True))
+
+	def set_game_over(self, move, in_check):
+		if len(move) == 0:
+			self.checkmate = in_check
+			self.stalemate = not in_check
+		else:
+			self.checkmate = False
+			self.stalemate = False
+		return move
@@ -0,0 +1,195 @@
+import argparse
+import mmap
+import struct
+import sys
+from engine import SQUARE_TUPLES, START_FEN, GameState, Move
+import perft
+import pgn
+
+
+'''
+opening book file: an 8 byte header (magic, entry count) and then fixed size entries sorted by
+zobrist key, heaviest move first within a key. lookups binary search the memory mapped file,
+so worker processes opening the same book share the page cache instead of loading copies
+'''
+MAGIC = b'CBK1'
+HEADER = struct.Struct('>4sI')
+ENTRY = struct.Struct('>QHH') # zobrist key, start square << 6 | end square, weight
+MAX_WEIGHT = 0xffff
+
+
+def encode_move(move):
+	return (move.start_row * 8 + move.start_col) << 6 | (move.end_row * 8 + move.end_col)
+
+
+def decode_move(gs, encoded):
+	'''
+	Move for gs straight from the 16 bit book encoding, no move generation
+	'''
+	start = SQUARE_TUPLES[encoded >> 6]
+	end = SQUARE_TUPLES[encoded & 63]
+	piece = gs.board[start[0]][start[1]]
+	is_castle_move = piece[1] == 'K' and abs(end[1] - start[1]) == 2
+	is_enpassant_move = piece[1] == 'p' and start[1] != end[1] and gs.board[end[0]][end[1]] == '--'
+	return Move(start, end, gs.board, is_enpassant_move, is_castle_move)
+
+
+def collect(lines, counts=None, max_ply=20, gs=None):
+	'''
+	count (zobrist key, move) over the first max_ply moves of every line, a line is a list of
+	coordinate moves played from the starting position
+	'''
+	if counts is None:
+		counts = {}
+	if gs is None:
+		gs = GameState()
+	for moves in lines:
+		gs.load_fen(START_FEN)
+		for notation in moves[:max_ply]:
+			key = gs.zobrist_key
+			for move in gs.get_valid_move():
+				if move.get_chess_notation() == notation:
+					break
+			else:
+				break # rest of the line is unusable
+			entry = (key, encode_move(move))
+			counts[entry] = counts.get(entry, 0) + 1
+			gs.make_move(move)
+	return counts
+
+
+def pgn_lines(stream):
+	'''
+	coordinate move lists of the games in a pgn stream that start from the normal position
+	'''
+	for game, moves in pgn.replay_games(stream):
+		if 'FEN' not in game.headers:
+			yield [move.get_chess_notation() for move in moves]
+
+
+def text_lines(stream):
+	'''
+	one game per line as coordinate moves, like 'e2e4 e7e5 g1f3'
+	'''
+	for line in stream:
+		line = line.strip()
+		if line and not line.startswith('#'):
+			yield line.split()
+
+
+def write_book(counts, path, min_count=1):
+	'''
+	write counted entries as a sorted book, returns the number of entries
+	'''
+	entries = sorted(((key, move, min(count, MAX_WEIGHT)) for (key, move), count in counts.items() if count >= min_count),
+					 key=lambda entry: (entry[0], -entry[2], entry[1]))
+	with open(path, 'wb') as f:
+		f.write(HEADER.pack(MAGIC, len(entries)))
+		for entry in entries:
+			f.write(ENTRY.pack(*entry))
+	return len(entries)
+
+
+class OpeningBook:
+	def __init__(self, path):
+		self.file = open(path, 'rb')
+		self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, self.count = HEADER.unpack_from(self.data, 0)
+		if magic != MAGIC or HEADER.size + self.count * ENTRY.size > len(self.data):
+			self.close()
+			raise ValueError(f'{path} is not an opening book')
+
+	def close(self):
+		if self.data is not None:
+			self.data.close()
+			self.data = None
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def __len__(self):
+		return self.count
+
+	def entries(self, key):
+		'''
+		[(encoded move, weight)] for a zobrist key, heaviest first
+		'''
+		data = self.data
+		lo, hi = 0, self.count
+		while lo < hi: # first entry with a key >= key
+			mid = (lo + hi) // 2
+			if ENTRY.unpack_from(data, HEADER.size + mid * ENTRY.size)[0] < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		found = []
+		while lo < self.count:
+			entry_key, move, weight = ENTRY.unpack_from(data, HEADER.size + lo * ENTRY.size)
+			if entry_key != key:
+				break
+			found.append((move, weight))
+			lo += 1
+		return found
+
+	def moves(self, gs):
+		'''
+		[(Move, weight)] for the position of gs, empty when it is out of book
+		'''
+		found = []
+		for encoded, weight in self.entries(gs.zobrist_key):
+			start = SQUARE_TUPLES[encoded >> 6]
+			piece = gs.board[start[0]][start[1]]
+			if piece != '--' and (piece[0] == 'w') == gs.white_to_move: # guards against a key collision
+				found.append((decode_move(gs, encoded), weight))
+		return found
+
+	def choose(self, gs, rng=None):
+		'''
+		a book move for gs picked by weight, the heaviest one without rng, None out of book
+		'''
+		found = self.moves(gs)
+		if not found:
+			return None
+		if rng is None:
+			return found[0][0]
+		return rng.choices([move for move, _ in found], [weight for _, weight in found])[0]
+
+
+def main():
+	parser = argparse.ArgumentParser(description='build and probe opening books')
+	commands = parser.add_subparsers(dest='command', required=True)
+	build = commands.add_parser('build', help='book from pgn files or coordinate move lists')
+	build.add_argument('book')
+	build.add_argument('files', nargs='*', help='.pgn files or text files with one move list per line, stdin when none')
+	build.add_argument('--max-ply', type=int, default=20)
+	build.add_argument('--min-count', type=int, default=1, help='drop moves played fewer times')
+	probe = commands.add_parser('probe', help='book moves for a position')
+	probe.add_argument('book')
+	probe.add_argument('fen', nargs='?', default=START_FEN)
+	probe.add_argument('--moves', default='', help='coordinate moves to play first')
+	args = parser.parse_args()
+
+	if args.command == 'build':
+		counts = {}
+		gs = GameState()
+		streams = [open(path, encoding='utf-8', errors='replace') for path in args.files] or [sys.stdin]
+		for path, stream in zip(args.files or ['-'], streams):
+			with stream:
+				lines = pgn_lines(stream) if path.endswith('.pgn') else text_lines(stream)
+				collect(lines, counts, args.max_ply, gs)
+		print(f'{write_book(counts, args.book, args.min_count)} entries written to {args.book}')
+	else:
+		gs = GameState()
+		gs.load_fen(args.fen)
+		perft.play_moves(gs, args.moves)
+		with OpeningBook(args.book) as book:
+			for move, weight in book.moves(gs):
+				print(f'{move.get_chess_notation()} {weight}')
+
+
+if __name__ == '__main__':
+	main()
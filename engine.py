@@ -1,5 +1,105 @@
+import random
+from array import array
+from evaluation import PHASE, PST_EG, PST_MG, blend, compute_evaluation
+
+
+# zobrist keys, fixed seed so the same position hashes the same in every process
+_zobrist_random = random.Random(2023)
+ZOBRIST_PIECES = {color + piece: [_zobrist_random.getrandbits(64) for _ in range(64)] for color in 'wb' for piece in 'pNBRQK'}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLE = [_zobrist_random.getrandbits(64) for _ in range(16)] # indexed by CastleRights.to_bits()
+ZOBRIST_ENPASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)] # indexed by file
+
+SQUARE_TUPLES = [divmod(sq, 8) for sq in range(64)] # shared (row, col) tuples so undo does not build new ones
+UNDO_STACK_SIZE = 512 # plies preallocated per GameState, doubled when a game gets longer
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+START_SNAPSHOT = None # (board, zobrist key, mg, eg, phase) of START_FEN, filled by the first GameState.reset
+FEN_PIECES = {'P': 'wp', 'N': 'wN', 'B': 'wB', 'R': 'wR', 'Q': 'wQ', 'K': 'wK',
+			  'p': 'bp', 'n': 'bN', 'b': 'bB', 'r': 'bR', 'q': 'bQ', 'k': 'bK'}
+PIECES_FEN = {v:k for k,v in FEN_PIECES.items()}
+_fen_rank_cache = {} # rank text like 'pp1ppppp' -> parsed row, the same ranks come up again and again
+
+
+def parse_fen_rank(rank):
+	row = _fen_rank_cache.get(rank)
+	if row is None:
+		row = []
+		for char in rank:
+			if char in '12345678':
+				row.extend(['--'] * int(char))
+			elif char in FEN_PIECES:
+				row.append(FEN_PIECES[char])
+			else:
+				raise ValueError(f'bad piece {char!r} in fen rank {rank!r}')
+		if len(row) != 8:
+			raise ValueError(f'fen rank {rank!r} does not have 8 squares')
+		row = tuple(row)
+		if len(_fen_rank_cache) < 4096:
+			_fen_rank_cache[rank] = row
+	return row
+
+
+def parse_fen(fen):
+	'''
+	split a fen into (board, white_to_move, castle rights, enpassant_possible, halfmove clock, fullmove number),
+	the move counters are optional and default to 0 and 1
+	'''
+	fields = fen.split()
+	if len(fields) < 4 or len(fields) > 6:
+		raise ValueError(f'fen needs 4 to 6 fields: {fen!r}')
+	ranks = fields[0].split('/')
+	if len(ranks) != 8:
+		raise ValueError(f'fen board needs 8 ranks: {fields[0]!r}')
+	board = [list(parse_fen_rank(rank)) for rank in ranks]
+	if fields[1] not in ('w', 'b'):
+		raise ValueError(f'bad side to move {fields[1]!r}')
+	castling = fields[2]
+	if castling != '-' and (castling.strip('KQkq') != '' or len(set(castling)) != len(castling)):
+		raise ValueError(f'bad castling field {castling!r}')
+	castle_rights = CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling)
+	# move generation trusts the board, so anything it cannot play from is rejected here
+	for right, row, rook_col, color in (('K', 7, 7, 'w'), ('Q', 7, 0, 'w'), ('k', 0, 7, 'b'), ('q', 0, 0, 'b')):
+		if right in castling and (board[row][4] != color + 'K' or board[row][rook_col] != color + 'R'):
+			raise ValueError(f'castling right {right} without king and rook on their home squares')
+	if 'wp' in board[0] or 'bp' in board[0] or 'wp' in board[7] or 'bp' in board[7]:
+		raise ValueError(f'pawn on the first or last rank: {fields[0]!r}')
+	kings = {'wK': [], 'bK': []}
+	for row in range(8):
+		for col in range(8):
+			if board[row][col] in kings:
+				kings[board[row][col]].append((row, col))
+	if len(kings['wK']) != 1 or len(kings['bK']) != 1:
+		raise ValueError(f'fen needs one king of each color: {fen!r}')
+	# the side that just moved cannot have left its king in check, move generation would capture it
+	probe = GameState.__new__(GameState)
+	probe.board = board
+	enemy_row, enemy_col = kings['bK' if fields[1] == 'w' else 'wK'][0]
+	if probe.is_square_attacked(enemy_row, enemy_col, fields[1]):
+		raise ValueError(f'side not to move is in check: {fen!r}')
+	if fields[3] == '-':
+		enpassant_possible = ()
+	elif len(fields[3]) == 2 and fields[3][0] in Move.files_to_cols and fields[3][1] == ('6' if fields[1] == 'w' else '3'):
+		enpassant_possible = (Move.ranks_to_rows[fields[3][1]], Move.files_to_cols[fields[3][0]])
+		# the pawn that just pushed two squares stands behind the target, which it passed over from an empty start
+		row, col = enpassant_possible
+		pushed_row, start_row, pawn = (row + 1, row - 1, 'bp') if fields[1] == 'w' else (row - 1, row + 1, 'wp')
+		if board[pushed_row][col] != pawn or board[row][col] != '--' or board[start_row][col] != '--':
+			raise ValueError(f'en passant square {fields[3]!r} without a pawn that just pushed past it')
+	else:
+		raise ValueError(f'bad en passant square {fields[3]!r}')
+	try:
+		halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+		fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+	except ValueError:
+		raise ValueError(f'bad move counters in fen {fen!r}') from None
+	if not 0 <= halfmove_clock <= 65535 or fullmove_number < 1: # far from what the 32 bit undo stack slot holds, even after a long game from here
+		raise ValueError(f'move counters out of range in fen {fen!r}')
+	return board, fields[1] == 'w', castle_rights, enpassant_possible, halfmove_clock, fullmove_number
+
+
 class GameState:
-	def __init__(self):
+	def __init__(self, move_cache=None):
 		self.board = [
 			['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
 			['bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp'],
@@ -10,14 +110,6 @@ class GameState:
 			['wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'],
 			['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']
 		] # 8x8 dimention
-		self.move_function = {
-							'p': self.get_pawn_move, 
-							'R': self.get_rook_move, 
-							'B': self.get_bishop_move,
-							'Q': self.get_queen_move,
-							'K': self.get_king_move,
-							'N': self.get_knight_move
-							}
 		self.white_to_move = True
 		self.move_log = []
 		self.white_king_location = (7,4)
@@ -26,23 +118,79 @@ class GameState:
 		self.stalemate = False
 		self.enpassant_possible = () # coordinate for the square where en passant capture is possible
 		self.current_castling_right = CastleRights(True, True, True, True)
-		self.castle_rights_log = [CastleRights(self.current_castling_right.wks, self.current_castling_right.bks, 
-											   self.current_castling_right.wqs, self.current_castling_right.bqs)]
+		self.use_pins_and_checks = True # False falls back to make/undo filtering of every pseudo-legal move
+		self.in_check_flag = False
+		self.pins = {} # (row, col) of pinned ally piece -> direction of the pin seen from the king
+		self.checks = [] # (row, col, dir_row, dir_col) of each enemy piece giving check
+		self.zobrist_debug = False # True recomputes the key from scratch after every make/undo and compares
+		self.zobrist_key = self.compute_zobrist_key()
+		self.move_cache = move_cache # optional move_cache.MoveCache consulted by get_valid_move
+		self.halfmove_clock = 0 # moves since the last capture or pawn move
+		self.fullmove_number = 1
+		# undo record of ply i (the state before move_log[i]) lives at index i of these arrays,
+		# the captured piece is already on the Move
+		self.undo_castle_bits = array('B', bytes(UNDO_STACK_SIZE))
+		self.undo_enpassant = array('b', bytes(UNDO_STACK_SIZE)) # row*8 + col, -1 for none
+		self.undo_halfmove_clock = array('I', bytes(4 * UNDO_STACK_SIZE))
+		self.undo_zobrist_key = array('Q', bytes(8 * UNDO_STACK_SIZE))
+		self.undo_eval_mg = array('i', bytes(4 * UNDO_STACK_SIZE))
+		self.undo_eval_eg = array('i', bytes(4 * UNDO_STACK_SIZE))
+		self.undo_eval_phase = array('B', bytes(UNDO_STACK_SIZE))
+		# material + piece-square scores from white's side, kept up to date by make_move
+		self.eval_mg, self.eval_eg, self.eval_phase = compute_evaluation(self.board)
+		self.eval_debug = False # True recomputes the evaluation from scratch after every make/undo and compares
+		# draws, set by get_valid_move next to checkmate and stalemate
+		self.threefold_repetition = False
+		self.fifty_move_draw = False
+		self.repetition_counts = {self.zobrist_key: 1} # zobrist key -> times the position occurred in this game
 
 
 	def make_move(self, move):
 		'''
 		basic chess move does not include catling and pawn promotion etc.
 		'''
+		# push the undo record
+		ply = len(self.move_log)
+		if ply == len(self.undo_zobrist_key):
+			self.grow_undo_stack()
+		castle_bits = self.current_castling_right.to_bits()
+		self.undo_castle_bits[ply] = castle_bits
+		self.undo_enpassant[ply] = self.enpassant_possible[0]*8 + self.enpassant_possible[1] if self.enpassant_possible else -1
+		self.undo_halfmove_clock[ply] = self.halfmove_clock
+		self.undo_zobrist_key[ply] = self.zobrist_key
+		self.undo_eval_mg[ply] = self.eval_mg
+		self.undo_eval_eg[ply] = self.eval_eg
+		self.undo_eval_phase[ply] = self.eval_phase
+
+		# hash and evaluation: lift the piece, drop the capture, put the piece (or its queen) down
+		piece = move.piece_moved
+		placed = piece[0]+'Q' if move.is_pawn_promotion else piece
+		start_sq = move.start_row*8 + move.start_col
+		end_sq = move.end_row*8 + move.end_col
+		key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[piece][start_sq] ^ ZOBRIST_PIECES[placed][end_sq]
+		mg = self.eval_mg - PST_MG[piece][start_sq] + PST_MG[placed][end_sq]
+		eg = self.eval_eg - PST_EG[piece][start_sq] + PST_EG[placed][end_sq]
+		phase = self.eval_phase + PHASE[placed] - PHASE[piece]
+		if move.piece_captured != '--':
+			captured_sq = move.start_row*8 + move.end_col if move.is_enpassant_move else end_sq
+			key ^= ZOBRIST_PIECES[move.piece_captured][captured_sq]
+			mg -= PST_MG[move.piece_captured][captured_sq]
+			eg -= PST_EG[move.piece_captured][captured_sq]
+			phase -= PHASE[move.piece_captured]
+		if self.enpassant_possible:
+			enpassant_col = self.zobrist_enpassant_col()
+			if enpassant_col is not None:
+				key ^= ZOBRIST_ENPASSANT[enpassant_col]
+
 		self.board[move.start_row][move.start_col] = '--'
 		self.board[move.end_row][move.end_col] = move.piece_moved
 		self.move_log.append(move)
 		self.white_to_move = not self.white_to_move
 		# update king location after moved
 		if move.piece_moved == 'wK':
-			self.white_king_location = (move.end_row, move.end_col)
+			self.white_king_location = SQUARE_TUPLES[move.end_row*8 + move.end_col]
 		elif move.piece_moved == 'bK':
-			self.black_king_location = (move.end_row, move.end_col)
+			self.black_king_location = SQUARE_TUPLES[move.end_row*8 + move.end_col]
 
 		# pawn promotion
 		if move.is_pawn_promotion:
@@ -61,16 +209,44 @@ class GameState:
 		# castling move
 		if move.is_castle_move:
 			if move.end_col - move.start_col == 2: # king side move
-				self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1] # move rook
-				self.board[move.end_row][move.end_col+1] = '--' # erase the old rook
+				rook_col, rook_end_col = move.end_col+1, move.end_col-1
 			else: # queen side move
-				self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2] # move rook
-				self.board[move.end_row][move.end_col-2] = '--' # erase the old rook
-
-		# update the castle rights - whenver it is a rook or a king move
-		self.update_castle_rights(move)
-		self.castle_rights_log.append(CastleRights(self.current_castling_right.wks, self.current_castling_right.bks,
-											   self.current_castling_right.wqs, self.current_castling_right.bqs))
+				rook_col, rook_end_col = move.end_col-2, move.end_col+1
+			rook = self.board[move.end_row][rook_col]
+			self.board[move.end_row][rook_end_col] = rook # move rook
+			self.board[move.end_row][rook_col] = '--' # erase the old rook
+			if rook != '--':
+				rook_sq = move.end_row*8 + rook_col
+				rook_end_sq = move.end_row*8 + rook_end_col
+				key ^= ZOBRIST_PIECES[rook][rook_sq] ^ ZOBRIST_PIECES[rook][rook_end_sq]
+				mg += PST_MG[rook][rook_end_sq] - PST_MG[rook][rook_sq]
+				eg += PST_EG[rook][rook_end_sq] - PST_EG[rook][rook_sq]
+
+		# update the castle rights - whenver it is a rook or a king move, or a rook gets captured
+		if castle_bits and (move.piece_moved[1] in 'KR' or move.piece_captured[1] == 'R'):
+			self.update_castle_rights(move)
+			key ^= ZOBRIST_CASTLE[castle_bits] ^ ZOBRIST_CASTLE[self.current_castling_right.to_bits()]
+		if self.enpassant_possible:
+			enpassant_col = self.zobrist_enpassant_col()
+			if enpassant_col is not None:
+				key ^= ZOBRIST_ENPASSANT[enpassant_col]
+		self.zobrist_key = key
+		self.eval_mg = mg
+		self.eval_eg = eg
+		self.eval_phase = phase
+		if self.zobrist_debug:
+			self.check_zobrist_key()
+		if self.eval_debug:
+			self.check_evaluation()
+		self.repetition_counts[key] = self.repetition_counts.get(key, 0) + 1
+
+		# move counters
+		if move.piece_moved[1] == 'p' or move.piece_captured != '--':
+			self.halfmove_clock = 0
+		else:
+			self.halfmove_clock += 1
+		if move.piece_moved[0] == 'b':
+			self.fullmove_number += 1
 
 
 	def undo_move(self):
@@ -80,20 +256,28 @@ class GameState:
 			self.board[move.end_row][move.end_col] = move.piece_captured
 			self.white_to_move = not self.white_to_move
 			if move.piece_moved == 'wK':
-				self.white_king_location = (move.start_row, move.start_col)
+				self.white_king_location = SQUARE_TUPLES[move.start_row*8 + move.start_col]
 			elif move.piece_moved == 'bK':
-				self.black_king_location = (move.start_row, move.start_col)
+				self.black_king_location = SQUARE_TUPLES[move.start_row*8 + move.start_col]
 			# undo en passant
 			if move.is_enpassant_move:
 				self.board[move.end_row][move.end_col] = '--' #leave landing square blank
 				self.board[move.start_row][move.end_col] = move.piece_captured
-				self.enpassant_possible = (move.end_row, move.end_col)
-			# undo 2 sq pawn advance
-			if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:
-				self.enpassant_possible = ()
-			# undo castling rights
-			self.castle_rights_log.pop()
-			self.current_castling_right = self.castle_rights_log[-1] # last object
+			# restore from the undo record, castle rights are written back into the same object
+			ply = len(self.move_log)
+			count = self.repetition_counts[self.zobrist_key] - 1
+			if count:
+				self.repetition_counts[self.zobrist_key] = count
+			else:
+				del self.repetition_counts[self.zobrist_key]
+			enpassant = self.undo_enpassant[ply]
+			self.enpassant_possible = SQUARE_TUPLES[enpassant] if enpassant >= 0 else ()
+			self.current_castling_right.set_bits(self.undo_castle_bits[ply])
+			self.halfmove_clock = self.undo_halfmove_clock[ply]
+			self.zobrist_key = self.undo_zobrist_key[ply]
+			self.eval_mg = self.undo_eval_mg[ply]
+			self.eval_eg = self.undo_eval_eg[ply]
+			self.eval_phase = self.undo_eval_phase[ply]
 			# undo castling move
 			if move.is_castle_move:
 				if move.end_col - move.start_col == 2: #king side
@@ -102,6 +286,152 @@ class GameState:
 				else: #queenside
 					self.board[move.end_row][move.end_col-2] = self.board[move.end_row][move.end_col+1]
 					self.board[move.end_row][move.end_col+1] = '--'
+			if move.piece_moved[0] == 'b':
+				self.fullmove_number -= 1
+			if self.zobrist_debug:
+				self.check_zobrist_key()
+			if self.eval_debug:
+				self.check_evaluation()
+
+
+	def grow_undo_stack(self):
+		size = len(self.undo_zobrist_key)
+		self.undo_castle_bits.extend(bytes(size))
+		self.undo_enpassant.extend(bytes(size))
+		self.undo_halfmove_clock.extend(array('I', bytes(4 * size)))
+		self.undo_zobrist_key.extend(array('Q', bytes(8 * size)))
+		self.undo_eval_mg.extend(array('i', bytes(4 * size)))
+		self.undo_eval_eg.extend(array('i', bytes(4 * size)))
+		self.undo_eval_phase.extend(bytes(size))
+
+	def load_fen(self, fen):
+		'''
+		replace the whole position with fen, the move log starts empty. reuse one GameState
+		and call this in a loop to load many positions without building new objects
+		'''
+		board, white_to_move, castle_rights, enpassant_possible, halfmove_clock, fullmove_number = parse_fen(fen)
+		for row in range(8):
+			if 'wK' in board[row]:
+				white_king_location = (row, board[row].index('wK'))
+			if 'bK' in board[row]:
+				black_king_location = (row, board[row].index('bK'))
+		self.board = board
+		self.white_to_move = white_to_move
+		self.white_king_location = white_king_location
+		self.black_king_location = black_king_location
+		self.move_log = []
+		self.checkmate = False
+		self.stalemate = False
+		self.enpassant_possible = enpassant_possible
+		self.current_castling_right = castle_rights
+		self.halfmove_clock = halfmove_clock
+		self.fullmove_number = fullmove_number
+		self.zobrist_key = self.compute_zobrist_key()
+		self.eval_mg, self.eval_eg, self.eval_phase = compute_evaluation(self.board)
+		self.threefold_repetition = False
+		self.fifty_move_draw = False
+		self.repetition_counts = {self.zobrist_key: 1}
+
+	def reset(self):
+		'''
+		back to the starting position in place: board rows are overwritten and the starting key and
+		evaluation are reused instead of parsed and computed again, for pools that recycle GameStates
+		'''
+		global START_SNAPSHOT
+		if START_SNAPSHOT is None:
+			self.load_fen(START_FEN)
+			START_SNAPSHOT = ([row[:] for row in self.board], self.zobrist_key, self.eval_mg, self.eval_eg, self.eval_phase)
+			return
+		board, self.zobrist_key, self.eval_mg, self.eval_eg, self.eval_phase = START_SNAPSHOT
+		for row, start_row in zip(self.board, board):
+			row[:] = start_row
+		self.white_to_move = True
+		self.white_king_location = (7,4)
+		self.black_king_location = (0,4)
+		self.move_log.clear()
+		self.checkmate = False
+		self.stalemate = False
+		self.enpassant_possible = ()
+		self.current_castling_right.set_bits(15)
+		self.halfmove_clock = 0
+		self.fullmove_number = 1
+		self.threefold_repetition = False
+		self.fifty_move_draw = False
+		self.repetition_counts = {self.zobrist_key: 1}
+
+	def get_fen(self):
+		ranks = []
+		for row in self.board:
+			rank = ''
+			empty = 0
+			for piece in row:
+				if piece == '--':
+					empty += 1
+				else:
+					if empty:
+						rank += str(empty)
+						empty = 0
+					rank += PIECES_FEN[piece]
+			if empty:
+				rank += str(empty)
+			ranks.append(rank)
+		rights = self.current_castling_right
+		castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+		if self.enpassant_possible == ():
+			enpassant = '-'
+		else:
+			enpassant = Move.cols_to_files[self.enpassant_possible[1]] + Move.rows_to_ranks[self.enpassant_possible[0]]
+		return f'{"/".join(ranks)} {"w" if self.white_to_move else "b"} {castling or "-"} {enpassant} {self.halfmove_clock} {self.fullmove_number}'
+
+
+	def compute_zobrist_key(self):
+		'''
+		hash the whole position from scratch: pieces, side to move, castle rights and en passant file
+		'''
+		key = 0
+		for row in range(8):
+			for col in range(8):
+				piece = self.board[row][col]
+				if piece != '--':
+					key ^= ZOBRIST_PIECES[piece][row*8 + col]
+		if not self.white_to_move:
+			key ^= ZOBRIST_BLACK_TO_MOVE
+		key ^= ZOBRIST_CASTLE[self.current_castling_right.to_bits()]
+		enpassant_col = self.zobrist_enpassant_col()
+		if enpassant_col is not None:
+			key ^= ZOBRIST_ENPASSANT[enpassant_col]
+		return key
+
+	def zobrist_enpassant_col(self):
+		'''
+		the en passant file only counts when a pawn of the side to move stands ready to capture,
+		so positions that differ only by an unusable en passant square share a key
+		'''
+		if self.enpassant_possible == ():
+			return None
+		row, col = self.enpassant_possible
+		if self.white_to_move:
+			pawn_row, pawn = row + 1, 'wp'
+		else:
+			pawn_row, pawn = row - 1, 'bp'
+		if (col-1 >= 0 and self.board[pawn_row][col-1] == pawn) or (col+1 <= 7 and self.board[pawn_row][col+1] == pawn):
+			return col
+		return None
+
+	def evaluate(self):
+		'''
+		static evaluation in centipawns for the side to move, constant time from the incremental scores
+		'''
+		score = blend(self.eval_mg, self.eval_eg, self.eval_phase)
+		return score if self.white_to_move else -score
+
+	def check_evaluation(self):
+		if (self.eval_mg, self.eval_eg, self.eval_phase) != compute_evaluation(self.board):
+			raise AssertionError(f'incremental evaluation drifted after {len(self.move_log)} moves')
+
+	def check_zobrist_key(self):
+		if self.zobrist_key != self.compute_zobrist_key():
+			raise AssertionError(f'zobrist key drifted after {len(self.move_log)} moves')
 
 
 	def update_castle_rights(self, move):
@@ -123,12 +453,180 @@ class GameState:
 					self.current_castling_right.bqs = False
 				elif move.start_col == 7: # black right rook
 					self.current_castling_right.bks = False
+		# a rook captured on its starting corner takes that castle right with it
+		if move.piece_captured == 'wR' and move.end_row == 7:
+			if move.end_col == 0:
+				self.current_castling_right.wqs = False
+			elif move.end_col == 7:
+				self.current_castling_right.wks = False
+		elif move.piece_captured == 'bR' and move.end_row == 0:
+			if move.end_col == 0:
+				self.current_castling_right.bqs = False
+			elif move.end_col == 7:
+				self.current_castling_right.bks = False
 
 
 	def get_valid_move(self):
-		temp_enpassant_possible = self.enpassant_possible
-		temp_castling_rights = CastleRights(self.current_castling_right.wks, self.current_castling_right.bks,
-			                                self.current_castling_right.wqs, self.current_castling_right.bqs)
+		entry = self.move_cache.get(self.zobrist_key) if self.move_cache is not None else None
+		if entry is not None:
+			move, self.checkmate, self.stalemate, self.in_check_flag = entry[:4]
+			move = list(move)
+		else:
+			if self.use_pins_and_checks:
+				move = self.get_valid_move_pins_and_checks()
+			else:
+				move = self.get_valid_move_make_undo()
+			if self.move_cache is not None:
+				in_check = self.in_check_flag if self.use_pins_and_checks else self.in_check()
+				self.move_cache.put(self.zobrist_key, move, self.checkmate, self.stalemate, in_check)
+		# draws depend on the game history, so they are never cached; checkmate wins over both
+		self.threefold_repetition = not self.checkmate and self.repetition_counts.get(self.zobrist_key, 0) >= 3
+		self.fifty_move_draw = not self.checkmate and self.halfmove_clock >= 100
+		return move
+
+	def is_repetition(self, times=2):
+		'''
+		True when the current position has occurred at least times in this game, a dict lookup
+		'''
+		return self.repetition_counts.get(self.zobrist_key, 0) >= times
+
+	def get_valid_move_pins_and_checks(self):
+		'''
+		compute checks and pins once from the king square, then filter pseudo-legal moves without make/undo
+		'''
+		self.in_check_flag, self.pins, self.checks = self.check_for_pins_and_checks()
+		if self.white_to_move:
+			king_row, king_col = self.white_king_location
+		else:
+			king_row, king_col = self.black_king_location
+
+		valid_squares = None # None means no check, any destination is fine
+		if len(self.checks) == 1:
+			check_row, check_col, dir_row, dir_col = self.checks[0]
+			if self.board[check_row][check_col][1] == 'N': # knight check can only be answered by capturing it
+				valid_squares = {(check_row, check_col)}
+			else: # capture the checker or block the ray between it and the king
+				valid_squares = set()
+				for i in range(1, 8):
+					square = (king_row + dir_row * i, king_col + dir_col * i)
+					valid_squares.add(square)
+					if square == (check_row, check_col):
+						break
+
+		move = []
+		for m in self.get_all_possible_move():
+			if m.piece_moved[1] == 'K':
+				if self.king_move_is_safe(m.end_row, m.end_col):
+					move.append(m)
+			elif m.is_enpassant_move: # can even answer a double check, so test it on the board
+				if self.enpassant_is_safe(m):
+					move.append(m)
+			elif len(self.checks) > 1: # double check, only king moves
+				continue
+			else:
+				if valid_squares is not None and (m.end_row, m.end_col) not in valid_squares:
+					continue
+				pin = self.pins.get((m.start_row, m.start_col))
+				if pin is not None and (m.end_row - m.start_row) * pin[1] != (m.end_col - m.start_col) * pin[0]:
+					continue # pinned piece must stay on the line between king and pinner
+				move.append(m)
+		if not self.in_check_flag:
+			self.get_castle_moves(king_row, king_col, move)
+
+		if len(move) == 0:
+			if self.in_check_flag:
+				self.checkmate = True
+			else:
+				self.stalemate = True
+		else:
+			self.checkmate = False
+			self.stalemate = False
+		return move
+
+	def king_move_is_safe(self, end_row, end_col):
+		'''
+		look for checks as if the king stood on (end_row, end_col)
+		'''
+		if self.white_to_move:
+			king_location = self.white_king_location
+			self.white_king_location = (end_row, end_col)
+			in_check = self.check_for_pins_and_checks()[0]
+			self.white_king_location = king_location
+		else:
+			king_location = self.black_king_location
+			self.black_king_location = (end_row, end_col)
+			in_check = self.check_for_pins_and_checks()[0]
+			self.black_king_location = king_location
+		return not in_check
+
+	def enpassant_is_safe(self, move):
+		'''
+		en passant removes two pawns from the same rank, so check it on the board directly
+		'''
+		self.board[move.start_row][move.start_col] = '--'
+		self.board[move.start_row][move.end_col] = '--'
+		self.board[move.end_row][move.end_col] = move.piece_moved
+		in_check = self.check_for_pins_and_checks()[0]
+		self.board[move.start_row][move.start_col] = move.piece_moved
+		self.board[move.start_row][move.end_col] = move.piece_captured
+		self.board[move.end_row][move.end_col] = '--'
+		return not in_check
+
+	def check_for_pins_and_checks(self):
+		'''
+		walk outward from the king: returns (in_check, pins, checks)
+		'''
+		pins = {}
+		checks = []
+		in_check = False
+		if self.white_to_move:
+			enemy_color, ally_color = 'b', 'w'
+			start_row, start_col = self.white_king_location
+		else:
+			enemy_color, ally_color = 'w', 'b'
+			start_row, start_col = self.black_king_location
+		# first 4 are orthogonal, last 4 are diagonal
+		directions = ((-1,0), (0,-1), (1,0), (0,1), (-1,-1), (-1,1), (1,-1), (1,1))
+		for j in range(len(directions)):
+			d = directions[j]
+			possible_pin = None
+			for i in range(1,8):
+				end_row = start_row + d[0] * i
+				end_col = start_col + d[1] * i
+				if 0 <= end_row < 8 and 0 <= end_col < 8:
+					end_piece = self.board[end_row][end_col]
+					if end_piece[0] == ally_color and end_piece[1] != 'K': # own king is ignored when it is probing a square
+						if possible_pin is None:
+							possible_pin = (end_row, end_col)
+						else:
+							break # second ally piece, no pin or check in this direction
+					elif end_piece[0] == enemy_color:
+						piece_type = end_piece[1]
+						# orthogonal rook, diagonal bishop, adjacent pawn toward us, queen anywhere, adjacent king
+						if (0 <= j <= 3 and piece_type == 'R') or \
+								(4 <= j <= 7 and piece_type == 'B') or \
+								(i == 1 and piece_type == 'p' and ((enemy_color == 'w' and 6 <= j <= 7) or (enemy_color == 'b' and 4 <= j <= 5))) or \
+								(piece_type == 'Q') or (i == 1 and piece_type == 'K'):
+							if possible_pin is None:
+								in_check = True
+								checks.append((end_row, end_col, d[0], d[1]))
+							else:
+								pins[possible_pin] = d
+						break # any enemy piece blocks the rest of the ray
+				else:
+					break
+		knight_moves = ((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1))
+		for m in knight_moves:
+			end_row = start_row + m[0]
+			end_col = start_col + m[1]
+			if 0 <= end_row < 8 and 0 <= end_col < 8:
+				end_piece = self.board[end_row][end_col]
+				if end_piece[0] == enemy_color and end_piece[1] == 'N':
+					in_check = True
+					checks.append((end_row, end_col, m[0], m[1]))
+		return in_check, pins, checks
+
+	def get_valid_move_make_undo(self):
 		move = self.get_all_possible_move()
 		if self.white_to_move:
 			self.get_castle_moves(self.white_king_location[0], self.white_king_location[1], move)
@@ -150,9 +648,6 @@ class GameState:
 		else:
 			self.checkmate = False
 			self.stalemate = False
-
-		self.enpassant_possible = temp_enpassant_possible
-		self.current_castling_right = temp_castling_rights
 		return move
 
 	def in_check(self):
@@ -162,6 +657,52 @@ class GameState:
 			return self.square_under_attack(self.black_king_location[0], self.black_king_location[1])
 
 	def square_under_attack(self, row, col):
+		return self.is_square_attacked(row, col, 'b' if self.white_to_move else 'w')
+
+	def is_square_attacked(self, row, col, attacker_color):
+		'''
+		look outward from (row, col) along knight, pawn, king and sliding rays and
+		return on the first attacker of attacker_color, no Move objects are built
+		'''
+		board = self.board
+		knight = attacker_color + 'N'
+		for d in ((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1)):
+			end_row = row + d[0]
+			end_col = col + d[1]
+			if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col] == knight:
+				return True
+		# white pawns capture towards row 0, so a white attacker sits one row below the square
+		pawn_row = row + 1 if attacker_color == 'w' else row - 1
+		if 0 <= pawn_row < 8:
+			pawn = attacker_color + 'p'
+			if (col-1 >= 0 and board[pawn_row][col-1] == pawn) or (col+1 <= 7 and board[pawn_row][col+1] == pawn):
+				return True
+		king = attacker_color + 'K'
+		for d in ((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1)):
+			end_row = row + d[0]
+			end_col = col + d[1]
+			if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col] == king:
+				return True
+		queen = attacker_color + 'Q'
+		for slider, directions in ((attacker_color + 'R', ((-1,0), (0,-1), (1,0), (0,1))),
+								   (attacker_color + 'B', ((-1,-1), (-1,1), (1,-1), (1,1)))):
+			for d in directions:
+				end_row = row + d[0]
+				end_col = col + d[1]
+				while 0 <= end_row < 8 and 0 <= end_col < 8:
+					end_piece = board[end_row][end_col]
+					if end_piece != '--':
+						if end_piece == slider or end_piece == queen:
+							return True
+						break # blocked by the first piece on the ray
+					end_row += d[0]
+					end_col += d[1]
+		return False
+
+	def square_under_attack_by_move_list(self, row, col):
+		'''
+		original full opponent move generation, kept to cross check is_square_attacked
+		'''
 		self.white_to_move = not self.white_to_move
 		opp_move = self.get_all_possible_move()
 		self.white_to_move = not self.white_to_move
@@ -177,7 +718,7 @@ class GameState:
 				turn = self.board[row][col][0] # get b or w move
 				if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
 					piece = self.board[row][col][1] # return pieces
-					self.move_function[piece](row, col, move)
+					MOVE_FUNCTIONS[piece](self, row, col, move)
 		return move
 
 	def get_pawn_move(self, row, col, move):
@@ -311,11 +852,23 @@ class GameState:
 				moves.append(Move((row, col), (row, col+2), self.board, is_castle_move=True))
 
 	def get_queen_side_castle_moves(self, row, col, moves):
-		if self.board[row][col-1] == '--' and self.board[row][col-2] == '--' and self.board[row][col-3]:
+		if self.board[row][col-1] == '--' and self.board[row][col-2] == '--' and self.board[row][col-3] == '--':
 			if not self.square_under_attack(row, col-1) and not self.square_under_attack(row, col-2):
 				moves.append(Move((row, col), (row, col-2), self.board, is_castle_move=True))
 
 
+# generator per piece letter, plain functions called with the GameState so that whatever is set on
+# the class (instrumentation wrappers) is what runs, instead of methods bound once per instance
+MOVE_FUNCTIONS = {
+	'p': GameState.get_pawn_move,
+	'R': GameState.get_rook_move,
+	'B': GameState.get_bishop_move,
+	'Q': GameState.get_queen_move,
+	'K': GameState.get_king_move,
+	'N': GameState.get_knight_move,
+}
+
+
 #################################################################################
 class CastleRights:
 	def __init__(self, wks, bks, wqs, bqs):
@@ -324,9 +877,22 @@ class CastleRights:
 		self.wqs = wqs
 		self.bqs = bqs
 
+	def to_bits(self):
+		return self.wks | self.bks << 1 | self.wqs << 2 | self.bqs << 3
+
+	def set_bits(self, bits):
+		self.wks = bits & 1 != 0
+		self.bks = bits & 2 != 0
+		self.wqs = bits & 4 != 0
+		self.bqs = bits & 8 != 0
+
 
 #################################################################################
 class Move:
+	# fixed attribute slots instead of a per-instance __dict__, move generation builds a lot of these
+	__slots__ = ('start_row', 'start_col', 'end_row', 'end_col', 'piece_moved', 'piece_captured',
+				 'is_pawn_promotion', 'is_enpassant_move', 'is_castle_move')
+
 	# maps keys to values with dictionary
 	ranks_to_rows = {
 	'1': 7,
@@ -355,35 +921,36 @@ class Move:
 	cols_to_files = {v:k for k,v in files_to_cols.items()}
 
 	def __init__(self, start_sq, end_sq, board, is_enpassant_move=False, is_castle_move=False):
-		self.start_row = start_sq[0]
-		self.start_col = start_sq[1]
-		self.end_row = end_sq[0]
-		self.end_col = end_sq[1]
-		self.piece_moved = board[self.start_row][self.start_col]
-		self.piece_captured = board[self.end_row][self.end_col]
+		self.start_row, self.start_col = start_sq
+		self.end_row, self.end_col = end_sq
+		self.piece_moved = piece_moved = board[self.start_row][self.start_col]
+
+		# pawn promotion, a pawn only ever reaches the far rank so the row is tested first
+		self.is_pawn_promotion = (self.end_row == 0 or self.end_row == 7) and piece_moved[1] == 'p'
 
-		# pawn promotion
-		self.is_pawn_promotion = (self.piece_moved == 'wp' and self.end_row == 0) or (self.piece_moved == 'bp' and self.end_row == 7)
-		#### same as written below ####
-		# self.is_pawn_promotion = False
-		# if (self.piece_moved == 'wp' and self.end_row == 0) or (self.piece_moved == 'bp' and self.end_row == 7):
-			# self.is_pawn_promotion = True
-		
 		# en passant
 		self.is_enpassant_move = is_enpassant_move
-		if self.is_enpassant_move:
-			self.piece_captured = 'wp' if self.piece_moved =='bp' else 'bp'
+		if is_enpassant_move:
+			self.piece_captured = 'wp' if piece_moved == 'bp' else 'bp'
+		else:
+			self.piece_captured = board[self.end_row][self.end_col]
 		#castle move
 		self.is_castle_move = is_castle_move
-		
 
-		self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+	@property
+	def move_id(self):
+		# decoded on demand, only equality and hashing need it
+		return self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
 
 	def __eq__(self, other):
 		if isinstance(other, Move):
-			return self.move_id == other.move_id
+			return self.start_row == other.start_row and self.start_col == other.start_col and \
+				self.end_row == other.end_row and self.end_col == other.end_col
 		return False
 
+	def __hash__(self):
+		return self.move_id
+
 	def get_rank_file(self, row, col):
 		return self.cols_to_files[col] + self.rows_to_ranks[row]
 
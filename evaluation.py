@@ -0,0 +1,125 @@
+'''
+material and piece-square tables blended by game phase. tables are written from white's side
+with row 0 as rank 8, the way GameState.board is laid out; black reads them mirrored
+'''
+
+# middlegame and endgame material
+MATERIAL_MG = {'p': 82, 'N': 337, 'B': 365, 'R': 477, 'Q': 1025, 'K': 0}
+MATERIAL_EG = {'p': 94, 'N': 281, 'B': 297, 'R': 512, 'Q': 936, 'K': 0}
+# how much each piece counts towards the middlegame, a full board adds up to MAX_PHASE
+PHASE_WEIGHT = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24
+
+PAWN_TABLE = [
+	  0,  0,  0,  0,  0,  0,  0,  0,
+	 50, 50, 50, 50, 50, 50, 50, 50,
+	 10, 10, 20, 30, 30, 20, 10, 10,
+	  5,  5, 10, 25, 25, 10,  5,  5,
+	  0,  0,  0, 20, 20,  0,  0,  0,
+	  5, -5,-10,  0,  0,-10, -5,  5,
+	  5, 10, 10,-20,-20, 10, 10,  5,
+	  0,  0,  0,  0,  0,  0,  0,  0,
+]
+KNIGHT_TABLE = [
+	-50,-40,-30,-30,-30,-30,-40,-50,
+	-40,-20,  0,  0,  0,  0,-20,-40,
+	-30,  0, 10, 15, 15, 10,  0,-30,
+	-30,  5, 15, 20, 20, 15,  5,-30,
+	-30,  0, 15, 20, 20, 15,  0,-30,
+	-30,  5, 10, 15, 15, 10,  5,-30,
+	-40,-20,  0,  5,  5,  0,-20,-40,
+	-50,-40,-30,-30,-30,-30,-40,-50,
+]
+BISHOP_TABLE = [
+	-20,-10,-10,-10,-10,-10,-10,-20,
+	-10,  0,  0,  0,  0,  0,  0,-10,
+	-10,  0,  5, 10, 10,  5,  0,-10,
+	-10,  5,  5, 10, 10,  5,  5,-10,
+	-10,  0, 10, 10, 10, 10,  0,-10,
+	-10, 10, 10, 10, 10, 10, 10,-10,
+	-10,  5,  0,  0,  0,  0,  5,-10,
+	-20,-10,-10,-10,-10,-10,-10,-20,
+]
+ROOK_TABLE = [
+	  0,  0,  0,  0,  0,  0,  0,  0,
+	  5, 10, 10, 10, 10, 10, 10,  5,
+	 -5,  0,  0,  0,  0,  0,  0, -5,
+	 -5,  0,  0,  0,  0,  0,  0, -5,
+	 -5,  0,  0,  0,  0,  0,  0, -5,
+	 -5,  0,  0,  0,  0,  0,  0, -5,
+	 -5,  0,  0,  0,  0,  0,  0, -5,
+	  0,  0,  0,  5,  5,  0,  0,  0,
+]
+QUEEN_TABLE = [
+	-20,-10,-10, -5, -5,-10,-10,-20,
+	-10,  0,  0,  0,  0,  0,  0,-10,
+	-10,  0,  5,  5,  5,  5,  0,-10,
+	 -5,  0,  5,  5,  5,  5,  0, -5,
+	  0,  0,  5,  5,  5,  5,  0, -5,
+	-10,  5,  5,  5,  5,  5,  0,-10,
+	-10,  0,  5,  0,  0,  0,  0,-10,
+	-20,-10,-10, -5, -5,-10,-10,-20,
+]
+KING_MG_TABLE = [
+	-30,-40,-40,-50,-50,-40,-40,-30,
+	-30,-40,-40,-50,-50,-40,-40,-30,
+	-30,-40,-40,-50,-50,-40,-40,-30,
+	-30,-40,-40,-50,-50,-40,-40,-30,
+	-20,-30,-30,-40,-40,-30,-30,-20,
+	-10,-20,-20,-20,-20,-20,-20,-10,
+	 20, 20,  0,  0,  0,  0, 20, 20,
+	 20, 30, 10,  0,  0, 10, 30, 20,
+]
+KING_EG_TABLE = [
+	-50,-40,-30,-20,-20,-30,-40,-50,
+	-30,-20,-10,  0,  0,-10,-20,-30,
+	-30,-10, 20, 30, 30, 20,-10,-30,
+	-30,-10, 30, 40, 40, 30,-10,-30,
+	-30,-10, 30, 40, 40, 30,-10,-30,
+	-30,-10, 20, 30, 30, 20,-10,-30,
+	-30,-30,  0,  0,  0,  0,-30,-30,
+	-50,-30,-30,-30,-30,-30,-30,-50,
+]
+TABLES_MG = {'p': PAWN_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': QUEEN_TABLE, 'K': KING_MG_TABLE}
+TABLES_EG = {'p': PAWN_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': QUEEN_TABLE, 'K': KING_EG_TABLE}
+
+
+def _signed_tables(material, tables):
+	'''
+	piece -> 64 scores with material included, positive for white and negative for black
+	'''
+	signed = {}
+	for piece_type, table in tables.items():
+		signed['w' + piece_type] = [material[piece_type] + table[sq] for sq in range(64)]
+		# black's square (row, col) reads white's table at (7 - row, col)
+		signed['b' + piece_type] = [-(material[piece_type] + table[(7 - sq // 8) * 8 + sq % 8]) for sq in range(64)]
+	return signed
+
+
+# PST_MG[piece][row*8 + col], what make_move adds and removes
+PST_MG = _signed_tables(MATERIAL_MG, TABLES_MG)
+PST_EG = _signed_tables(MATERIAL_EG, TABLES_EG)
+PHASE = {color + piece_type: weight for piece_type, weight in PHASE_WEIGHT.items() for color in 'wb'}
+
+
+def compute_evaluation(board):
+	'''
+	scan the whole board: (middlegame score, endgame score, phase) from white's point of view
+	'''
+	mg = eg = phase = 0
+	for row in range(8):
+		for col in range(8):
+			piece = board[row][col]
+			if piece != '--':
+				mg += PST_MG[piece][row*8 + col]
+				eg += PST_EG[piece][row*8 + col]
+				phase += PHASE[piece]
+	return mg, eg, phase
+
+
+def blend(mg, eg, phase):
+	'''
+	tapered score, all middlegame with a full set of pieces and all endgame with only kings and pawns
+	'''
+	phase = min(phase, MAX_PHASE) # promotions can push it past a full board
+	return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
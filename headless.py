@@ -0,0 +1,142 @@
+import argparse
+import json
+import sys
+import time
+from engine import START_FEN, GameState
+import instrumentation
+import perft
+import search
+from tablebase import Tablebases
+
+
+'''
+the engine without pygame: one position per input line, one json object per output line.
+a line is a fen, 'startpos', or either of them followed by 'moves e2e4 e7e5 ...'.
+a line with only coordinate moves is played from the starting position
+'''
+
+
+def parse_position(line):
+	'''
+	(fen, moves) from an input line
+	'''
+	position, _, moves = line.partition(' moves ')
+	position = position.strip()
+	if position == 'moves': # 'moves e2e4' with nothing in front
+		position, moves = 'startpos', ''
+	elif position.startswith('moves '):
+		position, moves = 'startpos', position[6:]
+	if position == 'startpos':
+		return START_FEN, moves
+	if '/' not in position: # bare move list
+		return START_FEN, (position + ' ' + moves).strip()
+	return position, moves
+
+
+def set_position(gs, line):
+	fen, moves = parse_position(line)
+	gs.load_fen(fen)
+	perft.play_moves(gs, moves)
+
+
+def run_moves(gs, args):
+	moves = gs.get_valid_move()
+	return {
+		'moves': [move.get_chess_notation() for move in moves],
+		'checkmate': gs.checkmate,
+		'stalemate': gs.stalemate,
+		'threefold_repetition': gs.threefold_repetition,
+		'fifty_move_draw': gs.fifty_move_draw,
+	}
+
+
+def run_perft(gs, args):
+	start = time.perf_counter()
+	if args.divide:
+		divide = perft.perft_divide(gs, args.depth)
+		nodes = sum(divide.values())
+	else:
+		divide = None
+		nodes = perft.perft(gs, args.depth)
+	seconds = time.perf_counter() - start
+	result = {'depth': args.depth, 'nodes': nodes, 'seconds': round(seconds, 6), 'nps': round(nodes / seconds) if seconds else 0}
+	if divide is not None:
+		result['divide'] = divide
+	return result
+
+
+def run_best(gs, args):
+	result = search.find_best_move(gs, args.depth, args.time, args.nodes, tablebases=args.tablebases)
+	return {
+		'best_move': result.best_move.get_chess_notation() if result.best_move is not None else None,
+		'score': result.score,
+		'depth': result.depth,
+		'pv': result.pv_notation(),
+		'nodes': result.nodes,
+		'seconds': round(result.seconds, 6),
+		'nps': round(result.nps),
+	}
+
+
+COMMANDS = {
+	'moves': run_moves,
+	'perft': run_perft,
+	'best': run_best,
+}
+
+
+def run_lines(lines, command, args, out=sys.stdout):
+	'''
+	run command on every position line and write a json line per position as soon as it is done.
+	a bad fen or illegal move gives an error object for that line and the batch carries on
+	'''
+	gs = GameState()
+	run = COMMANDS[command]
+	count = 0
+	for line in lines:
+		line = line.strip()
+		if not line or line.startswith('#'):
+			continue
+		try:
+			set_position(gs, line)
+			result = {'input': line, 'fen': gs.get_fen()}
+			result.update(run(gs, args))
+		except ValueError as e:
+			result = {'input': line, 'error': str(e)}
+		out.write(json.dumps(result) + '\n')
+		out.flush()
+		count += 1
+	return count
+
+
+def main():
+	parser = argparse.ArgumentParser(description='run the engine on positions from files or stdin, json lines out')
+	parser.add_argument('--metrics', choices=('json', 'prometheus'), help='record engine counters and timings, written to stderr at the end')
+	commands = parser.add_subparsers(dest='command', required=True)
+	moves = commands.add_parser('moves', help='legal moves and game end flags')
+	perft_parser = commands.add_parser('perft', help='node count to a depth')
+	perft_parser.add_argument('--depth', type=int, default=3)
+	perft_parser.add_argument('--divide', action='store_true', help='node count per root move')
+	best = commands.add_parser('best', help='best move search')
+	best.add_argument('--depth', type=int, default=64, help='deepest iteration')
+	best.add_argument('--time', type=float, help='seconds per position')
+	best.add_argument('--nodes', type=int, help='node budget per position')
+	best.add_argument('--tablebases', metavar='DIR', type=Tablebases, help='endgame table directory')
+	for command in (moves, perft_parser, best):
+		command.add_argument('files', nargs='*', help='position files, stdin when none are given')
+	args = parser.parse_args()
+	if args.command == 'best' and args.time is None and args.nodes is None and args.depth == 64:
+		args.depth = 4 # no budget at all would search forever
+
+	metrics = instrumentation.enable() if args.metrics else None
+	streams = [open(path, encoding='utf-8') for path in args.files] or [sys.stdin]
+	for stream in streams:
+		with stream:
+			run_lines(stream, args.command, args)
+	if metrics is not None:
+		instrumentation.disable()
+		sys.stderr.write(metrics.to_json(indent=1) + '\n' if args.metrics == 'json' else metrics.to_prometheus())
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,231 @@
+import bisect
+import functools
+import json
+import time
+from engine import MOVE_FUNCTIONS, GameState, Move
+
+
+'''
+opt-in counters and timing histograms for the engine hot paths. enable() swaps timing wrappers
+into GameState and Move at class level and disable() puts the original functions back, so with
+instrumentation off the engine runs its own code and nothing else
+'''
+# calls that get a timing histogram, the count comes with it
+TIMED = ('get_valid_move', 'get_valid_move_pins_and_checks', 'get_valid_move_make_undo', 'check_for_pins_and_checks',
+		 'get_all_possible_move', 'make_move', 'undo_move')
+# calls that are only counted, too small and too frequent to time
+COUNTED = ('square_under_attack', 'is_square_attacked', 'in_check', 'king_move_is_safe', 'enpassant_is_safe',
+		   'get_pawn_move', 'get_rook_move', 'get_bishop_move', 'get_knight_move', 'get_queen_move', 'get_king_move',
+		   'get_castle_moves')
+# list returning calls whose result length is added to a counter
+RESULT_SIZES = {'get_all_possible_move': 'pseudo_legal_moves', 'get_valid_move': 'legal_moves'}
+# upper bounds in seconds, 1us to 1s in steps of 4
+BUCKETS = (1e-6, 4e-6, 16e-6, 64e-6, 256e-6, 1e-3, 4e-3, 16e-3, 64e-3, 0.256, 1.0)
+# generator calls made for one piece, the queen runs the rook and bishop generators too
+GENERATORS = {
+	'p': ('get_pawn_move',),
+	'N': ('get_knight_move',),
+	'B': ('get_bishop_move',),
+	'R': ('get_rook_move',),
+	'Q': ('get_queen_move', 'get_rook_move', 'get_bishop_move'),
+	'K': ('get_king_move',),
+}
+
+
+class Metrics:
+	def __init__(self, buckets=BUCKETS):
+		self.buckets = buckets
+		self.reset()
+
+	def reset(self):
+		self.counters = {}
+		self.histograms = {} # name -> [count per bucket with one overflow bucket, sum of seconds, count]
+
+	def count(self, name, value=1):
+		self.counters[name] = self.counters.get(name, 0) + value
+
+	def observe(self, name, seconds):
+		histogram = self.histograms.get(name)
+		if histogram is None:
+			histogram = self.histograms[name] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+		histogram[0][bisect.bisect_left(self.buckets, seconds)] += 1
+		histogram[1] += seconds
+		histogram[2] += 1
+
+	def snapshot(self):
+		'''
+		plain dict of everything recorded, bucket counts are cumulative like prometheus
+		'''
+		histograms = {}
+		for name, (counts, total, count) in sorted(self.histograms.items()):
+			cumulative = []
+			running = 0
+			for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+				running += bucket_count
+				cumulative.append([bound if bound != float('inf') else '+Inf', running])
+			histograms[name] = {'count': count, 'sum': total, 'mean': total / count if count else 0.0, 'buckets': cumulative}
+		return {'counters': dict(sorted(self.counters.items())), 'histograms': histograms}
+
+	def to_json(self, indent=None):
+		return json.dumps(self.snapshot(), indent=indent)
+
+	def to_prometheus(self, prefix='chess_engine'):
+		'''
+		prometheus text exposition format
+		'''
+		lines = []
+		calls = {name: value for name, value in self.counters.items() if name.startswith('calls.')}
+		if calls:
+			lines.append(f'# TYPE {prefix}_calls_total counter')
+			for name, value in sorted(calls.items()):
+				lines.append(f'{prefix}_calls_total{{function="{name[6:]}"}} {value}')
+		for name, value in sorted(self.counters.items()):
+			if not name.startswith('calls.'):
+				lines.append(f'# TYPE {prefix}_{name}_total counter')
+				lines.append(f'{prefix}_{name}_total {value}')
+		if self.histograms:
+			lines.append(f'# TYPE {prefix}_seconds histogram')
+			for name, data in self.snapshot()['histograms'].items():
+				for bound, count in data['buckets']:
+					lines.append(f'{prefix}_seconds_bucket{{function="{name}",le="{bound}"}} {count}')
+				lines.append(f'{prefix}_seconds_sum{{function="{name}"}} {data["sum"]}')
+				lines.append(f'{prefix}_seconds_count{{function="{name}"}} {data["count"]}')
+		return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+_originals = {} # (class, attribute) -> function replaced by enable
+
+
+def _timed(name, function, metrics):
+	perf_counter = time.perf_counter
+	observe = metrics.observe
+	size_counter = RESULT_SIZES.get(name)
+
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		start = perf_counter()
+		result = function(*args, **kwargs)
+		observe(name, perf_counter() - start)
+		if size_counter is not None:
+			metrics.count(size_counter, len(result))
+		return result
+	return wrapper
+
+
+def _counted(name, function, metrics):
+	counters = metrics.counters
+	key = 'calls.' + name
+
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		counters[key] = counters.get(key, 0) + 1
+		return function(*args, **kwargs)
+	return wrapper
+
+
+def enable(metrics=METRICS):
+	'''
+	start recording into metrics, affects every GameState in the process
+	'''
+	if _originals:
+		disable()
+	for name in TIMED:
+		_originals[(GameState, name)] = GameState.__dict__[name]
+		setattr(GameState, name, _timed(name, GameState.__dict__[name], metrics))
+	for name in COUNTED:
+		_originals[(GameState, name)] = GameState.__dict__[name]
+		setattr(GameState, name, _counted(name, GameState.__dict__[name], metrics))
+	_originals[(Move, '__init__')] = Move.__dict__['__init__']
+	Move.__init__ = _counted('Move', Move.__dict__['__init__'], metrics)
+	_rebind_move_functions()
+	return metrics
+
+
+def disable():
+	'''
+	put the original functions back, recorded numbers stay in the metrics object
+	'''
+	for (cls, name), function in _originals.items():
+		setattr(cls, name, function)
+	_originals.clear()
+	_rebind_move_functions()
+
+
+def _rebind_move_functions():
+	'''
+	get_all_possible_move dispatches through engine.MOVE_FUNCTIONS, point it at what the class holds now
+	'''
+	for letter, function in MOVE_FUNCTIONS.items():
+		MOVE_FUNCTIONS[letter] = GameState.__dict__[function.__name__]
+
+
+def is_enabled():
+	return bool(_originals)
+
+
+class instrumented:
+	'''
+	with instrumented() as metrics: ... records only inside the block
+	'''
+	def __init__(self, metrics=None):
+		self.metrics = metrics if metrics is not None else Metrics()
+
+	def __enter__(self):
+		return enable(self.metrics)
+
+	def __exit__(self, *exc):
+		disable()
+
+
+def expected_generator_calls(gs, depth, calls=None):
+	'''
+	generator calls a perft to depth makes, counted from the pieces on the board without instrumentation
+	'''
+	calls = calls if calls is not None else {}
+	if depth == 0:
+		return calls
+	moves = gs.get_valid_move()
+	ally_color = 'w' if gs.white_to_move else 'b'
+	for row in gs.board:
+		for piece in row:
+			if piece[0] == ally_color:
+				for name in GENERATORS[piece[1]]:
+					calls[name] = calls.get(name, 0) + 1
+	for move in moves:
+		gs.make_move(move)
+		expected_generator_calls(gs, depth - 1, calls)
+		gs.undo_move()
+	return calls
+
+
+def check(depth=3):
+	'''
+	perft from the start on a GameState built before enable and on one built while enabled: both have
+	to record every piece generator call and one Move per pseudo-legal move (no castling within reach),
+	and once disabled nothing more is recorded. returns the number of Moves counted per run
+	'''
+	import perft
+	expected = expected_generator_calls(GameState(), depth)
+	built_before = GameState()
+	moves = None
+	for label in ('built before enable', 'built while enabled'):
+		with instrumented() as metrics:
+			gs = built_before if label == 'built before enable' else GameState()
+			perft.perft(gs, depth)
+		counters = metrics.counters
+		got = {name: counters.get('calls.' + name, 0) for name in expected}
+		if got != expected:
+			raise AssertionError(f'GameState {label}: generator calls {got} != {expected}')
+		if counters.get('calls.Move') != counters.get('pseudo_legal_moves'):
+			raise AssertionError(f'GameState {label}: {counters.get("calls.Move")} Moves built for {counters.get("pseudo_legal_moves")} pseudo-legal moves')
+		moves = counters['calls.Move']
+		recorded = metrics.snapshot()
+		perft.perft(gs, depth)
+		if metrics.snapshot() != recorded:
+			raise AssertionError(f'GameState {label}: still recording after disable')
+	return moves
+
+
+if __name__ == '__main__':
+	print(f'instrumentation check ok, {check()} Moves counted per run')
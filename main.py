@@ -1,11 +1,15 @@
 import pygame
 from engine import GameState, Move
+from worker import EngineWorker
 
 
 WIDTH =  HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT//DIMENSION # 64
 MAX_FPS = 15
+WHITE_HUMAN = True # False lets the engine play that side
+BLACK_HUMAN = True
+SEARCH_TIME = 2.0 # seconds the engine thinks per move
 IMAGES = {}
 
 def load_images():
@@ -14,91 +18,177 @@ def load_images():
 		IMAGES[piece] = pygame.transform.scale(pygame.image.load(f'images/{piece}.png'), (SQ_SIZE, SQ_SIZE))
 
 
-def hightlight_square(screen, gs, valid_move, sq_selected):
-	'''
-	highlight square selected and moves for piece selected
-	'''
-	if sq_selected != ():
-		row, col = sq_selected
-		if gs.board[row][col][0] == ('w' if gs.white_to_move else 'b'):
-			s = pygame.Surface((SQ_SIZE, SQ_SIZE)) # create hightlight with pygame surface
-			s.set_alpha(100) # transparency value -> 0 is pure transparency
-			s.fill(pygame.Color('blue'))
-			screen.blit(s, (col*SQ_SIZE, row*SQ_SIZE))
-			# hight moves from that square
-			s.fill(pygame.Color('yellow'))
-			for move in valid_move:
-				if move.start_row == row and move.start_col == col:
-					screen.blit(s, (move.end_col*SQ_SIZE, move.end_row*SQ_SIZE))
-
-
-def animate_move(move, screen, board, clock):
+BOARD_COLORS = [pygame.Color('white'), pygame.Color('grey')] # light and dark squares
+NO_HIGHLIGHT, SELECTED, TARGET = 0, 1, 2
+
+
+def square_rect(row, col):
+	return pygame.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+
+def build_board_surface():
 	'''
-	animate piece move
+	the empty board, rendered once and copied from instead of drawing 64 rects per frame
 	'''
-	global colors
-	dR = move.end_row - move.start_row # delta row
-	dC = move.end_col - move.start_col # delta col
-	frame_per_square = 10 # frames to move one square
-	frame_count = (abs(dR) + abs(dC)) * frame_per_square
-	for frame in range(frame_count + 1):
-		row, col = (move.start_row + dR*frame/frame_count, move.start_col + dC*frame/frame_count)
-		draw_board(screen)
-		draw_pieces(screen, board)
-		# erase piece moved from its ending square
-		color = colors[(move.end_row + move.end_col) % 2]
-		end_square = pygame.Rect(move.end_col*SQ_SIZE, move.end_row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-		pygame.draw.rect(screen, color, end_square)
-		# draw captured piece onto rectangle
-		if move.piece_captured != '--':
-			screen.blit(IMAGES[move.piece_captured], end_square)
-		# draw moving piece
-		screen.blit(IMAGES[move.piece_moved], pygame.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-		pygame.display.flip()
-		clock.tick(60)
-
-
-def draw_game_state(screen, gs, valid_move, sq_selected):
-	draw_board(screen)
-	hightlight_square(screen, gs, valid_move, sq_selected)
-	draw_pieces(screen, gs.board)
-
-
-def draw_board(screen):
-	global colors
-	colors = [pygame.Color('white'), pygame.Color('grey')] # return aka => [(255, 255, 255, 255), (190, 190, 190, 255)]
+	surface = pygame.Surface((WIDTH, HEIGHT))
 	for row in range(DIMENSION):
 		for col in range(DIMENSION):
-			color = colors[(row + col)%2] # return 0 and 1 => 0 for white, 1 for black
-			pygame.draw.rect(screen, color, pygame.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+			surface.fill(BOARD_COLORS[(row + col) % 2], square_rect(row, col))
+	return surface
 
 
-def draw_pieces(screen, board):
-	for row in range(DIMENSION):
-		for col in range(DIMENSION):
-			piece = board[row][col] # return gs.board[0][0] which is 'bR' in GameState
-			if piece != '--':
-				screen.blit(IMAGES[piece], pygame.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+def build_highlight_surface(color):
+	surface = pygame.Surface((SQ_SIZE, SQ_SIZE))
+	surface.set_alpha(100) # transparency value -> 0 is pure transparency
+	surface.fill(pygame.Color(color))
+	return surface
+
+
+class Renderer:
+	'''
+	keeps what every square showed last frame and redraws only the squares that changed,
+	then pushes just those rectangles to the display. board, highlights and text are rendered once
+	'''
+	def __init__(self, screen):
+		self.screen = screen
+		self.board_surface = build_board_surface()
+		self.highlights = {SELECTED: build_highlight_surface('blue'), TARGET: build_highlight_surface('yellow')}
+		self.font = pygame.font.SysFont('Helvitca', 32, True, False)
+		self.text_cache = {} # text -> (shadow, text surface, rect)
+		self.drawn = [None] * (DIMENSION * DIMENSION) # (piece, highlight) on screen per square, None forces a redraw
+		self.text = None
+
+	def invalidate(self):
+		'''
+		redraw everything on the next frame
+		'''
+		self.drawn = [None] * (DIMENSION * DIMENSION)
+		self.text = None
 
+	def square_states(self, gs, valid_move, sq_selected):
+		board = gs.board
+		highlight = {}
+		if sq_selected != ():
+			row, col = sq_selected
+			if board[row][col][0] == ('w' if gs.white_to_move else 'b'):
+				highlight[sq_selected] = SELECTED
+				for move in valid_move:
+					if move.start_row == row and move.start_col == col:
+						highlight[(move.end_row, move.end_col)] = TARGET
+		return [(board[row][col], highlight.get((row, col), NO_HIGHLIGHT)) for row in range(DIMENSION) for col in range(DIMENSION)]
+
+	def draw_square(self, row, col, piece, highlight=NO_HIGHLIGHT):
+		rect = square_rect(row, col)
+		self.screen.blit(self.board_surface, rect, rect)
+		if highlight != NO_HIGHLIGHT:
+			self.screen.blit(self.highlights[highlight], rect)
+		if piece != '--':
+			self.screen.blit(IMAGES[piece], rect)
+		return rect
+
+	def render_text(self, text):
+		cached = self.text_cache.get(text)
+		if cached is None:
+			shadow = self.font.render(text, 0, pygame.Color('Black'))
+			surface = self.font.render(text, 0, pygame.Color('Blue'))
+			rect = pygame.Rect(WIDTH/2 - shadow.get_width()/2, HEIGHT/2 - shadow.get_height()/2, shadow.get_width() + 2, shadow.get_height() + 2)
+			cached = self.text_cache[text] = (shadow, surface, rect)
+		return cached
+
+	def draw_text(self, text):
+		shadow, surface, rect = self.render_text(text)
+		self.screen.blit(shadow, rect)
+		self.screen.blit(surface, rect.move(2,2))
+		return rect
+
+	def draw(self, gs, valid_move, sq_selected, text=None):
+		'''
+		bring the screen up to date with gs, text is drawn over the middle of the board
+		'''
+		states = self.square_states(gs, valid_move, sq_selected)
+		if text != self.text and self.text is not None: # squares under the old text have to come back
+			old_rect = self.render_text(self.text)[2]
+			for sq in range(DIMENSION * DIMENSION):
+				if square_rect(sq // DIMENSION, sq % DIMENSION).colliderect(old_rect):
+					self.drawn[sq] = None
+		dirty = []
+		for sq, state in enumerate(states):
+			if state != self.drawn[sq]:
+				dirty.append(self.draw_square(sq // DIMENSION, sq % DIMENSION, *state))
+				self.drawn[sq] = state
+		if text is not None and (text != self.text or any(rect.colliderect(self.render_text(text)[2]) for rect in dirty)):
+			dirty.append(self.draw_text(text))
+		self.text = text
+		if dirty:
+			pygame.display.update(dirty)
+
+	def animate_move(self, move, board, clock):
+		'''
+		slide the moved piece, each frame redraws only the squares the piece passes over
+		'''
+		dR = move.end_row - move.start_row # delta row
+		dC = move.end_col - move.start_col # delta col
+		frame_per_square = 10 # frames to move one square
+		frame_count = (abs(dR) + abs(dC)) * frame_per_square
+		previous = None
+		for frame in range(frame_count + 1):
+			row, col = (move.start_row + dR*frame/frame_count, move.start_col + dC*frame/frame_count)
+			piece_rect = pygame.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+			area = piece_rect if previous is None else piece_rect.union(previous)
+			dirty = []
+			for r in range(max(area.top // SQ_SIZE, 0), min((area.bottom - 1) // SQ_SIZE, DIMENSION - 1) + 1):
+				for c in range(max(area.left // SQ_SIZE, 0), min((area.right - 1) // SQ_SIZE, DIMENSION - 1) + 1):
+					# the end square shows the captured piece until the moving piece lands
+					piece = move.piece_captured if (r, c) == (move.end_row, move.end_col) else board[r][c]
+					dirty.append(self.draw_square(r, c, piece))
+					self.drawn[r*DIMENSION + c] = None
+			self.screen.blit(IMAGES[move.piece_moved], piece_rect)
+			pygame.display.update(dirty)
+			previous = piece_rect
+			clock.tick(60)
+		self.drawn[move.start_row*DIMENSION + move.start_col] = None
+		self.drawn[move.end_row*DIMENSION + move.end_col] = None
+
+
+def game_over_text(gs):
+	'''
+	message for a finished game, None while it goes on
+	'''
+	if gs.checkmate:
+		return 'Black wins by checkmate' if gs.white_to_move else 'White wins by checkmate'
+	if gs.stalemate:
+		return 'Stalmate'
+	if gs.threefold_repetition:
+		return 'Draw by threefold repetition'
+	if gs.fifty_move_draw:
+		return 'Draw by fifty-move rule'
+	return None
 
-def draw_text(screen, text):
-	font = pygame.font.SysFont('Helvitca', 32, True, False)
-	text_object = font.render(text, 0, pygame.Color('Black'))
-	text_location = pygame.Rect(0,0, WIDTH, HEIGHT).move(WIDTH/2 - text_object.get_width()/2, HEIGHT/2 - text_object.get_height()/2)
-	screen.blit(text_object, text_location)
-	text_object = font.render(text, 0 , pygame.Color('Blue'))
-	screen.blit(text_object, text_location.move(2,2))
 
 def main():
 	pygame.init()
 	screen = pygame.display.set_mode((WIDTH, HEIGHT))
 	clock = pygame.time.Clock()
 	screen.fill(pygame.Color('white'))
+	pygame.display.flip()
+	worker = EngineWorker() # legal moves and search run on its thread, the loop keeps drawing
 	gs = GameState()
-	valid_move = gs.get_valid_move()
+	valid_move = [] # empty while the worker is busy, so clicks do nothing
+
+	def request(gs):
+		'''
+		drop whatever the worker is doing and ask for the position on the board now
+		'''
+		worker.cancel()
+		human_turn = WHITE_HUMAN if gs.white_to_move else BLACK_HUMAN
+		worker.submit('moves' if human_turn else 'search', gs.move_log, time_limit=SEARCH_TIME)
+
+	request(gs)
+	pending = True
 	move_made = False
 	animate = False
 	load_images()
+	renderer = Renderer(screen)
 	running = True
 	sq_selected = () # return (row, col) to keep track of last click of the users
 	player_click = [] # return [(6,4), (4,4)] to keep track of users click
@@ -107,8 +197,10 @@ def main():
 		for event in pygame.event.get():
 			if event.type == pygame.QUIT or event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
 				running = False
+			elif event.type == pygame.VIDEOEXPOSE: # window was covered, the screen has to be redrawn in full
+				renderer.invalidate()
 			elif event.type == pygame.MOUSEBUTTONDOWN:
-				if not game_over:
+				if not game_over and not pending:
 					location = pygame.mouse.get_pos() # return (x,y)
 					col = location[0]//SQ_SIZE
 					row = location[1]//SQ_SIZE
@@ -135,12 +227,15 @@ def main():
 							player_click = [sq_selected]
 			elif event.type == pygame.KEYDOWN:
 				if event.key == pygame.K_z: # undo the last move
+					worker.cancel() # a result for the position being left is stale
 					gs.undo_move()
 					move_made = True
 					animate = False
 				if event.key == pygame.K_r: # reset board if r key is pressed
 					gs = GameState()
-					valid_move = gs.get_valid_move()
+					request(gs)
+					pending = True
+					valid_move = []
 					sq_selected = ()
 					player_click = []
 					move_made = False
@@ -149,27 +244,32 @@ def main():
 
 		if move_made:
 			if animate:
-				animate_move(gs.move_log[-1], screen, gs.board, clock)
-			valid_move = gs.get_valid_move()
+				renderer.animate_move(gs.move_log[-1], gs.board, clock)
+			request(gs)
+			pending = True
+			valid_move = []
 			move_made = False
 			animate = False
 
-		draw_game_state(screen, gs, valid_move, sq_selected)
-		
-		if gs.checkmate:
-			game_over = True
-			if gs.white_to_move:
-				draw_text(screen, 'Black wins by checkmate')
-			else:
-				draw_text(screen, 'White wins by checkmate')
-		elif gs.stalemate:
-			game_over = True
-			draw_text(screen, 'Stalmate')
+		result = worker.poll()
+		if result is not None:
+			pending = False
+			valid_move = result.valid_move
+			gs.checkmate, gs.stalemate = result.checkmate, result.stalemate
+			gs.threefold_repetition, gs.fifty_move_draw = result.threefold_repetition, result.fifty_move_draw
+			if result.best is not None and game_over_text(gs) is None: # engine's turn, play its move
+				gs.make_move(result.best.best_move)
+				print(result.best.best_move.get_chess_notation())
+				move_made = True
+				animate = True
 
+		text = game_over_text(gs) if not pending else None
+		game_over = text is not None
+		renderer.draw(gs, valid_move, sq_selected, text) # only changed squares reach the display
 
 		clock.tick(MAX_FPS)
-		pygame.display.flip()
-		
+	worker.close()
+
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,72 @@
+import sys
+from collections import OrderedDict
+
+
+def estimate_move_bytes(move):
+	'''
+	rough size of one cached Move, the instance plus its attribute dict when it has one
+	'''
+	size = sys.getsizeof(move)
+	if hasattr(move, '__dict__'):
+		size += sys.getsizeof(move.__dict__)
+	return size
+
+
+class MoveCache:
+	'''
+	legal move lists keyed by GameState.zobrist_key, shared by any number of GameState objects.
+	memory is bounded by max_bytes (estimated), the least recently used position is evicted first
+	'''
+	ENTRY_BYTES = 200 # dict slot, key int, tuple and flags of one entry
+
+	def __init__(self, max_bytes=64 * 1024 * 1024):
+		self.max_bytes = max_bytes
+		self.entries = OrderedDict() # key -> (moves tuple, checkmate, stalemate, in_check, size)
+		self.bytes_used = 0
+		self.move_bytes = None # measured from the first move stored
+		self.hits = 0
+		self.misses = 0
+		self.stores = 0
+		self.evictions = 0
+
+	def get(self, key):
+		entry = self.entries.get(key)
+		if entry is None:
+			self.misses += 1
+			return None
+		self.entries.move_to_end(key)
+		self.hits += 1
+		return entry
+
+	def put(self, key, moves, checkmate, stalemate, in_check):
+		if key in self.entries:
+			return
+		if self.move_bytes is None and len(moves) != 0:
+			self.move_bytes = estimate_move_bytes(moves[0])
+		size = self.ENTRY_BYTES + sys.getsizeof(moves) + len(moves) * (self.move_bytes or 0)
+		if size > self.max_bytes:
+			return # would evict everything and still not fit
+		while self.bytes_used + size > self.max_bytes:
+			_, evicted = self.entries.popitem(last=False)
+			self.bytes_used -= evicted[4]
+			self.evictions += 1
+		self.entries[key] = (tuple(moves), checkmate, stalemate, in_check, size)
+		self.bytes_used += size
+		self.stores += 1
+
+	def clear(self):
+		self.entries.clear()
+		self.bytes_used = 0
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {
+			'entries': len(self.entries),
+			'bytes_used': self.bytes_used,
+			'max_bytes': self.max_bytes,
+			'hits': self.hits,
+			'misses': self.misses,
+			'stores': self.stores,
+			'evictions': self.evictions,
+			'hit_rate': self.hits / lookups if lookups else 0.0,
+		}
@@ -0,0 +1,114 @@
+import multiprocessing
+import os
+import time
+from engine import GameState
+import perft
+import search
+
+
+'''
+work goes to the pool as fen strings and comes back as plain dicts and notation,
+each worker process keeps one GameState and reloads it with load_fen per task
+'''
+_worker_gs = None
+
+
+def _init_worker():
+	global _worker_gs
+	_worker_gs = GameState()
+
+
+def _worker_state(fen, moves=''):
+	gs = _worker_gs if _worker_gs is not None else GameState()
+	gs.load_fen(fen)
+	perft.play_moves(gs, moves)
+	return gs
+
+
+def _perft_task(args):
+	fen, moves, depth = args
+	return perft.perft(_worker_state(fen, moves), depth)
+
+
+def _best_move_task(args):
+	fen, max_depth, time_limit, node_limit = args
+	result = search.find_best_move(_worker_state(fen), max_depth, time_limit, node_limit)
+	return {
+		'fen': fen,
+		'best_move': result.best_move.get_chess_notation() if result.best_move is not None else None,
+		'score': result.score,
+		'depth': result.depth,
+		'pv': result.pv_notation(),
+		'nodes': result.nodes,
+		'seconds': result.seconds,
+	}
+
+
+def _valid_move_task(fen):
+	gs = _worker_state(fen)
+	moves = gs.get_valid_move()
+	return {'fen': fen, 'moves': [move.get_chess_notation() for move in moves],
+			'checkmate': gs.checkmate, 'stalemate': gs.stalemate}
+
+
+def make_pool(processes=None):
+	return multiprocessing.Pool(processes or os.cpu_count(), initializer=_init_worker)
+
+
+def _run(task, jobs, processes, pool, chunksize=1):
+	'''
+	results in job order, on the given pool or a temporary one
+	'''
+	if pool is not None:
+		return pool.map(task, jobs, chunksize)
+	if processes == 1: # no pool for a single worker, keeps the 1 core baseline honest
+		_init_worker()
+		return [task(job) for job in jobs]
+	with make_pool(processes) as pool:
+		return pool.map(task, jobs, chunksize)
+
+
+def parallel_perft_divide(gs, depth, processes=None, pool=None):
+	'''
+	split perft at the root: one task per legal move of gs, returns {notation: nodes}
+	'''
+	fen = gs.get_fen()
+	notations = [move.get_chess_notation() for move in gs.get_valid_move()]
+	if depth <= 1:
+		return {notation: 1 for notation in notations}
+	counts = _run(_perft_task, [(fen, notation, depth - 1) for notation in notations], processes, pool)
+	return dict(zip(notations, counts))
+
+
+def parallel_perft(gs, depth, processes=None, pool=None):
+	if depth == 0:
+		return 1 # the root itself, like perft.perft
+	return sum(parallel_perft_divide(gs, depth, processes, pool).values())
+
+
+def batch_best_moves(fens, max_depth=64, time_limit=None, node_limit=None, processes=None, pool=None):
+	'''
+	best move search for every fen, one position per task, results in input order
+	'''
+	jobs = [(fen, max_depth, time_limit, node_limit) for fen in fens]
+	return _run(_best_move_task, jobs, processes, pool)
+
+
+def batch_valid_moves(fens, processes=None, pool=None, chunksize=64):
+	'''
+	legal moves and mate flags for every fen, cheap tasks so they travel in chunks
+	'''
+	return _run(_valid_move_task, list(fens), processes, pool, chunksize)
+
+
+def scaling(function, max_processes=None):
+	'''
+	time function(processes) for 1..max_processes workers, returns [(processes, seconds, speedup)]
+	'''
+	rows = []
+	for processes in range(1, (max_processes or os.cpu_count()) + 1):
+		start = time.perf_counter()
+		function(processes)
+		seconds = time.perf_counter() - start
+		rows.append((processes, seconds, rows[0][1] / seconds if rows else 1.0))
+	return rows
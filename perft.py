@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import platform
+import random
+import time
+from bitboard import BitboardGameState
+from engine import GameState
+
+
+# opening lines that reach pins, checks, en passant and castling quickly
+COMPARISON_LINES = [
+	'',
+	'e2e4 e7e5 g1f3 b8c6 f1c4 g8f6',
+	'e2e4 d7d6 f1b5 c7c6 d2d4 d8a5',
+	'e2e4 e7e6 e4e5 d7d5',
+	'd2d4 e7e5 d4e5 f7f5 c1g5 f8b4',
+	'e2e4 f7f6 d2d4 g7g5 d1h5',
+	'g1f3 g8f6 g2g3 g7g6 f1g2 f8g7 e1g1 e8g8',
+	'e2e4 d7d5 e4e5 f7f5 e1e2 e8f7 e2e3 f7e6 d1g4',
+]
+
+
+# standard perft positions and node counts per depth. promotion is always to a queen here,
+# so only depths without any promotion on the way are listed
+REFERENCE_POSITIONS = {
+	'start': ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', [20, 400, 8902, 197281, 4865609]),
+	'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', [48, 2039, 97862]),
+	'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+	'position6': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10', [46, 2079, 89890, 3894594]),
+}
+BACKENDS = {'gamestate': GameState, 'bitboard': BitboardGameState}
+BASELINE_FILE = 'perft_baseline.json'
+
+
+def play_moves(gs, moves):
+	'''
+	play space separated coordinate moves like 'e2e4 e7e5' from the current position
+	'''
+	for notation in moves.split():
+		for move in gs.get_valid_move():
+			if move.get_chess_notation() == notation:
+				gs.make_move(move)
+				break
+		else:
+			raise ValueError(f'illegal move {notation}')
+
+
+def perft(gs, depth):
+	if depth == 0:
+		return 1
+	nodes = 0
+	for move in gs.get_valid_move():
+		gs.make_move(move)
+		nodes += perft(gs, depth - 1)
+		gs.undo_move()
+	return nodes
+
+
+def perft_divide(gs, depth):
+	'''
+	node count below each root move, keyed by its notation
+	'''
+	divide = {}
+	for move in gs.get_valid_move():
+		gs.make_move(move)
+		divide[move.get_chess_notation()] = perft(gs, depth - 1)
+		gs.undo_move()
+	return divide
+
+
+def run_reference(backend='gamestate', max_depth=None, names=None):
+	'''
+	perft every reference position up to max_depth, checks the node counts and
+	returns per depth timings as a dict ready for json
+	'''
+	results = {}
+	for name, (fen, expected_counts) in REFERENCE_POSITIONS.items():
+		if names and name not in names:
+			continue
+		gs = BACKENDS[backend]()
+		gs.load_fen(fen)
+		results[name] = []
+		for depth in range(1, len(expected_counts) + 1):
+			if max_depth is not None and depth > max_depth:
+				break
+			start = time.perf_counter()
+			nodes = perft(gs, depth)
+			seconds = time.perf_counter() - start
+			expected = expected_counts[depth - 1]
+			results[name].append({'depth': depth, 'nodes': nodes, 'expected': expected, 'ok': nodes == expected,
+								  'seconds': seconds, 'nps': nodes / seconds if seconds else 0.0})
+	return results
+
+
+def print_reference(results):
+	for name, rows in results.items():
+		for row in rows:
+			status = 'ok' if row['ok'] else f'FAIL expected {row["expected"]}'
+			print(f'{name:10} depth {row["depth"]} {row["nodes"]:9} nodes {row["seconds"]:8.3f}s {row["nps"]:10.0f} nps {status}')
+
+
+def save_baseline(results, backend, path=BASELINE_FILE):
+	baseline = {}
+	if os.path.exists(path):
+		with open(path) as f:
+			baseline = json.load(f)
+	baseline[backend] = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+	with open(path, 'w') as f:
+		json.dump(baseline, f, indent=1)
+
+
+def check_baseline(results, backend, path=BASELINE_FILE, tolerance=0.2):
+	'''
+	compare nodes per second against the stored baseline, returns a list of regression messages.
+	a baseline file without an entry for backend counts as one regression
+	'''
+	with open(path) as f:
+		baseline = json.load(f).get(backend)
+	if baseline is None:
+		return [f'no {backend} baseline in {path}, record one with --save-baseline']
+	baseline = baseline['results']
+	regressions = []
+	for name, rows in results.items():
+		old_rows = {row['depth']: row for row in baseline.get(name, [])}
+		for row in rows:
+			old = old_rows.get(row['depth'])
+			if row['nodes'] < 10000:
+				continue # too short to time reliably
+			if old is not None and row['nps'] < old['nps'] * (1 - tolerance):
+				regressions.append(f'{name} depth {row["depth"]}: {row["nps"]:.0f} nps, baseline {old["nps"]:.0f} nps')
+	return regressions
+
+
+def valid_move_both_modes(gs):
+	'''
+	return (pins_and_checks result, make_undo result) as notation lists with the mate flags
+	'''
+	results = []
+	for use_pins_and_checks in (True, False):
+		gs.use_pins_and_checks = use_pins_and_checks
+		moves = gs.get_valid_move()
+		results.append(([m.get_chess_notation() for m in moves], gs.checkmate, gs.stalemate))
+	gs.use_pins_and_checks = True
+	return results
+
+
+def compare_attack_queries(gs, path=()):
+	'''
+	is_square_attacked must match full move generation on every square holding a piece of the side to move,
+	other squares differ on purpose: move generation skips defended pieces, counts pawn pushes onto
+	empty squares and misses pawn captures of them
+	'''
+	ally_color = 'w' if gs.white_to_move else 'b'
+	for row in range(8):
+		for col in range(8):
+			if gs.board[row][col][0] == ally_color and gs.square_under_attack(row, col) != gs.square_under_attack_by_move_list(row, col):
+				raise AssertionError(f'attack queries differ on {(row, col)} after {" ".join(path) or "start"}')
+
+
+def compare_legal_modes(gs, depth, path=()):
+	'''
+	walk the tree to depth and check both legal move modes agree at every node,
+	returns the number of nodes compared
+	'''
+	fast, slow = valid_move_both_modes(gs)
+	if fast != slow:
+		raise AssertionError(f'legal move modes differ after {" ".join(path) or "start"}: {fast} != {slow}')
+	compare_attack_queries(gs, path)
+	if depth == 0:
+		return 1
+	nodes = 1
+	for move in gs.get_valid_move():
+		gs.make_move(move)
+		nodes += compare_legal_modes(gs, depth - 1, path + (move.get_chess_notation(),))
+		gs.undo_move()
+	return nodes
+
+
+def compare_random_games(games, seed=0, max_ply=200):
+	'''
+	play seeded random games to the end and compare both modes at every ply
+	'''
+	rng = random.Random(seed)
+	nodes = 0
+	for _ in range(games):
+		gs = GameState()
+		gs.zobrist_debug = True # every make/undo also checks the incremental key and evaluation
+		gs.eval_debug = True
+		path = []
+		for _ in range(max_ply):
+			fast, slow = valid_move_both_modes(gs)
+			if fast != slow:
+				raise AssertionError(f'legal move modes differ after {" ".join(path)}: {fast} != {slow}')
+			compare_attack_queries(gs, path)
+			nodes += 1
+			moves = gs.get_valid_move()
+			if len(moves) == 0:
+				break
+			move = rng.choice(moves)
+			path.append(move.get_chess_notation())
+			gs.make_move(move)
+	return nodes
+
+
+def compare_backends(gs, bitboard_gs, depth, path=()):
+	'''
+	walk GameState and BitboardGameState in lockstep, move lists must match as sets
+	'''
+	moves = gs.get_valid_move()
+	bitboard_moves = bitboard_gs.get_valid_move()
+	expected = sorted(m.get_chess_notation() for m in moves)
+	if expected != sorted(m.get_chess_notation() for m in bitboard_moves) or \
+			(gs.checkmate, gs.stalemate) != (bitboard_gs.checkmate, bitboard_gs.stalemate):
+		raise AssertionError(f'backends differ after {" ".join(path) or "start"}')
+	if gs.board != bitboard_gs.board:
+		raise AssertionError(f'boards differ after {" ".join(path) or "start"}')
+	if depth == 0:
+		return 1
+	nodes = 1
+	bitboard_by_notation = {m.get_chess_notation(): m for m in bitboard_moves}
+	for move in moves:
+		notation = move.get_chess_notation()
+		gs.make_move(move)
+		bitboard_gs.make_move(bitboard_by_notation[notation])
+		nodes += compare_backends(gs, bitboard_gs, depth - 1, path + (notation,))
+		gs.undo_move()
+		bitboard_gs.undo_move()
+	return nodes
+
+
+def compare_random_backends(games, seed=0, max_ply=200):
+	rng = random.Random(seed)
+	nodes = 0
+	for _ in range(games):
+		gs = GameState()
+		bitboard_gs = BitboardGameState()
+		path = []
+		for _ in range(max_ply):
+			nodes += compare_backends(gs, bitboard_gs, 0, tuple(path))
+			moves = gs.get_valid_move()
+			if len(moves) == 0:
+				break
+			move = rng.choice(moves)
+			path.append(move.get_chess_notation())
+			gs.make_move(move)
+			play_moves(bitboard_gs, path[-1])
+	return nodes
+
+
+def run_comparisons(depth):
+	for line in COMPARISON_LINES:
+		gs = GameState()
+		play_moves(gs, line)
+		nodes = compare_legal_modes(gs, depth)
+		print(f'{line or "start position"}: {nodes} nodes agree')
+	print(f'random games: {compare_random_games(50)} nodes agree')
+	for name, (fen, _) in REFERENCE_POSITIONS.items():
+		gs = GameState()
+		gs.load_fen(fen)
+		print(f'{name}: {compare_legal_modes(gs, depth)} nodes agree')
+	for line in COMPARISON_LINES:
+		gs = GameState()
+		bitboard_gs = BitboardGameState()
+		play_moves(gs, line)
+		play_moves(bitboard_gs, line)
+		print(f'{line or "start position"}: {compare_backends(gs, bitboard_gs, depth + 1)} nodes agree on both backends')
+	print(f'random games: {compare_random_backends(200)} nodes agree on both backends')
+
+
+def main():
+	parser = argparse.ArgumentParser(description='perft driver and move generator checks')
+	parser.add_argument('--backend', choices=BACKENDS, default='gamestate')
+	commands = parser.add_subparsers(dest='command')
+	run = commands.add_parser('run', help='reference positions with node counts and timings')
+	run.add_argument('--depth', type=int, help='deepest depth to run, default all listed counts')
+	run.add_argument('--position', action='append', choices=REFERENCE_POSITIONS, help='only these positions')
+	run.add_argument('--json', action='store_true', help='print the results as json')
+	run.add_argument('--save-baseline', metavar='FILE', nargs='?', const=BASELINE_FILE)
+	run.add_argument('--check-baseline', metavar='FILE', nargs='?', const=BASELINE_FILE)
+	run.add_argument('--tolerance', type=float, default=0.2, help='allowed nps drop against the baseline')
+	divide = commands.add_parser('divide', help='node count per root move')
+	divide.add_argument('depth', type=int)
+	divide.add_argument('fen', nargs='?', default=REFERENCE_POSITIONS['start'][0])
+	divide.add_argument('--moves', default='', help='coordinate moves to play first, like "e2e4 e7e5"')
+	compare = commands.add_parser('compare', help='legal move modes and backends against each other')
+	compare.add_argument('--depth', type=int, default=2)
+	args = parser.parse_args()
+
+	if args.command == 'divide':
+		gs = BACKENDS[args.backend]()
+		try:
+			gs.load_fen(args.fen)
+			play_moves(gs, args.moves)
+		except ValueError as error:
+			parser.error(str(error))
+		start = time.perf_counter()
+		divide = perft_divide(gs, args.depth)
+		seconds = time.perf_counter() - start
+		for notation in sorted(divide):
+			print(f'{notation}: {divide[notation]}')
+		nodes = sum(divide.values())
+		print(f'\nmoves: {len(divide)}\nnodes: {nodes}\ntime: {seconds:.3f}s ({nodes / seconds if seconds else 0:.0f} nps)')
+	elif args.command == 'compare':
+		run_comparisons(args.depth)
+	else:
+		depth = args.depth if args.command == 'run' else 3
+		results = run_reference(args.backend, depth, args.position if args.command == 'run' else None)
+		if args.command == 'run' and args.json:
+			print(json.dumps(results, indent=1))
+		else:
+			print_reference(results)
+		failed = any(not row['ok'] for rows in results.values() for row in rows)
+		if args.command == 'run' and args.save_baseline:
+			if failed:
+				print('node counts failed, baseline not saved')
+			else:
+				save_baseline(results, args.backend, args.save_baseline)
+		if args.command == 'run' and args.check_baseline:
+			regressions = check_baseline(results, args.backend, args.check_baseline, args.tolerance)
+			for regression in regressions:
+				print(f'regression: {regression}')
+			failed = failed or len(regressions) != 0
+		raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,168 @@
+import re
+import sys
+import time
+from engine import START_FEN, GameState, Move
+
+
+HEADER_RE = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+# comments, variations and NAGs are dropped, what is left are move numbers, SAN and the result
+TOKEN_RE = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.(?:\.\.)?|1-0|0-1|1/2-1/2|\*|[^\s(){};$]+')
+SAN_RE = re.compile(r'^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+class PgnGame:
+	def __init__(self, headers, movetext):
+		self.headers = headers
+		self.movetext = movetext
+		self.error = None # set by replay when a move can not be resolved
+
+	def san_moves(self):
+		'''
+		SAN tokens of the main line, without move numbers, comments, variations or the result
+		'''
+		moves = []
+		variation_depth = 0
+		for token in TOKEN_RE.findall(self.movetext):
+			if token[0] == '0' and token.rstrip('+#!?') in ('0-0', '0-0-0'): # castling written with zeros
+				token = token.replace('0', 'O')
+			if token == '(':
+				variation_depth += 1
+			elif token == ')':
+				variation_depth -= 1
+			elif variation_depth == 0 and token[0] not in '{;$' and not token[0].isdigit() and token not in RESULTS:
+				moves.append(token)
+		return moves
+
+
+def read_games(stream):
+	'''
+	yield one PgnGame at a time from a text stream, only the current game is held in memory
+	'''
+	headers = {}
+	movetext = []
+	for line in stream:
+		line = line.strip()
+		if line.startswith('['):
+			if movetext: # a header after move text starts the next game
+				yield PgnGame(headers, '\n'.join(movetext))
+				headers = {}
+				movetext = []
+			match = HEADER_RE.match(line)
+			if match:
+				headers[match.group(1)] = match.group(2)
+		elif line and not line.startswith('%'):
+			movetext.append(line)
+	if headers or movetext:
+		yield PgnGame(headers, '\n'.join(movetext))
+
+
+def san_to_move(gs, san, valid_move=None):
+	'''
+	resolve a SAN move like 'Nbd7', 'exd5', 'e8=Q' or 'O-O' against the legal moves of gs
+	'''
+	if valid_move is None:
+		valid_move = gs.get_valid_move()
+	san = san.rstrip('+#!?')
+	if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+		col_change = 2 if san in ('O-O', '0-0') else -2
+		for move in valid_move:
+			if move.is_castle_move and move.end_col - move.start_col == col_change:
+				return move
+		raise ValueError(f'illegal castling {san}')
+	match = SAN_RE.match(san)
+	if match is None:
+		raise ValueError(f'bad SAN {san!r}')
+	piece, from_file, from_rank, _, square, promotion = match.groups()
+	if promotion is not None and promotion != 'Q':
+		raise ValueError(f'underpromotion {san} is not supported, pawns always promote to a queen')
+	piece = piece or 'p'
+	end_row = Move.ranks_to_rows[square[1]]
+	end_col = Move.files_to_cols[square[0]]
+	from_col = Move.files_to_cols[from_file] if from_file else None
+	from_row = Move.ranks_to_rows[from_rank] if from_rank else None
+	found = None
+	for move in valid_move:
+		if move.end_row == end_row and move.end_col == end_col and move.piece_moved[1] == piece and \
+				(from_col is None or move.start_col == from_col) and (from_row is None or move.start_row == from_row):
+			if found is not None:
+				raise ValueError(f'ambiguous SAN {san}')
+			found = move
+	if found is None:
+		raise ValueError(f'illegal move {san}')
+	return found
+
+
+def replay(game, gs=None):
+	'''
+	play the main line of game on gs (a fresh GameState if none), yielding each Move after it is made.
+	a FEN header sets the starting position
+	'''
+	if gs is None:
+		gs = GameState()
+	gs.load_fen(game.headers.get('FEN', START_FEN))
+	for san in game.san_moves():
+		move = san_to_move(gs, san)
+		gs.make_move(move)
+		yield move
+
+
+def replay_games(stream, gs=None):
+	'''
+	pipeline over a whole archive: yields (game, moves) for every game, one GameState is reused.
+	a game with a move that can not be resolved comes back with the moves up to it and game.error set
+	'''
+	if gs is None:
+		gs = GameState()
+	for game in read_games(stream):
+		moves = []
+		try:
+			for move in replay(game, gs):
+				moves.append(move)
+		except ValueError as e:
+			game.error = str(e)
+		yield game, moves
+
+
+def replay_positions(stream, gs=None):
+	'''
+	yields (game, fen) for every position reached in every game, starting position included
+	'''
+	if gs is None:
+		gs = GameState()
+	for game in read_games(stream):
+		try:
+			gs.load_fen(game.headers.get('FEN', START_FEN))
+			yield game, gs.get_fen()
+			for san in game.san_moves():
+				gs.make_move(san_to_move(gs, san))
+				yield game, gs.get_fen()
+		except ValueError as e:
+			game.error = str(e)
+
+
+def main():
+	'''
+	replay every game of the given pgn files (stdin without arguments) and report games per second
+	'''
+	streams = [open(path, encoding='utf-8', errors='replace') for path in sys.argv[1:]] or [sys.stdin]
+	games = plies = errors = 0
+	start = last_report = time.perf_counter()
+	for stream in streams:
+		with stream:
+			for game, moves in replay_games(stream):
+				games += 1
+				plies += len(moves)
+				if game.error is not None:
+					errors += 1
+				now = time.perf_counter()
+				if now - last_report >= 5:
+					print(f'{games} games {games / (now - start):.1f} games/s {plies / (now - start):.0f} plies/s', file=sys.stderr)
+					last_report = now
+	seconds = time.perf_counter() - start
+	print(f'{games} games, {plies} plies, {errors} errors in {seconds:.2f}s: '
+		  f'{games / seconds if seconds else 0:.1f} games/s, {plies / seconds if seconds else 0:.0f} plies/s')
+
+
+if __name__ == '__main__':
+	main()
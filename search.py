@@ -0,0 +1,166 @@
+import time
+
+
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0} # move ordering only
+MATE_SCORE = 100000 # minus the ply the mate happens at, so faster mates score higher
+INFINITY = 1000000
+CHECK_EVERY = 256 # nodes between clock checks
+MAX_TABLEBASE_PIECES = 4 # tables are only probed at or below this many pieces, kings included
+
+
+class SearchTimeout(Exception):
+	pass
+
+
+class SearchResult:
+	def __init__(self, best_move, score, depth, pv, nodes, seconds):
+		self.best_move = best_move
+		self.score = score
+		self.depth = depth # deepest fully searched iteration
+		self.pv = pv # principal variation, list of Move
+		self.nodes = nodes
+		self.seconds = seconds
+		self.nps = nodes / seconds if seconds else 0.0
+
+	def pv_notation(self):
+		return ' '.join(move.get_chess_notation() for move in self.pv)
+
+
+#################################################################################
+class Search:
+	'''
+	negamax alpha-beta with iterative deepening on top of a GameState. the position is
+	restored when search returns, even when the time or node budget cuts it short
+	'''
+	def __init__(self, gs, max_depth=64, time_limit=None, node_limit=None, on_iteration=None, tablebases=None):
+		self.gs = gs
+		self.max_depth = max_depth
+		self.time_limit = time_limit # seconds for the whole move, None for no limit
+		self.node_limit = node_limit
+		self.on_iteration = on_iteration # called with a SearchResult after every completed depth
+		self.tablebases = tablebases # Tablebases, positions with few enough pieces are scored from the tables
+		self.pieces = 0 # pieces on the board at the current node, kept up to date across make/undo
+		self.stop_requested = False
+		self.nodes = 0
+		self.deadline = None
+		self.killers = [] # two quiet moves per ply that caused a beta cutoff
+		self.history = {} # (piece moved, end row, end col) -> cutoff score for quiet moves
+		self.pv_table = []
+
+	def stop(self):
+		'''
+		ask a running search to return its last completed result, safe to call from another thread
+		'''
+		self.stop_requested = True
+
+	def check_limits(self):
+		if self.stop_requested or (self.deadline is not None and time.perf_counter() >= self.deadline) or \
+				(self.node_limit is not None and self.nodes >= self.node_limit):
+			raise SearchTimeout()
+
+	def search(self):
+		gs = self.gs
+		start = time.perf_counter()
+		self.deadline = start + self.time_limit if self.time_limit is not None else None
+		self.nodes = 0
+		self.killers = [[None, None] for _ in range(self.max_depth + 1)]
+		self.pv_table = [[] for _ in range(self.max_depth + 2)]
+		self.pieces = sum(piece != '--' for row in gs.board for piece in row)
+		root_moves = gs.get_valid_move()
+		if len(root_moves) == 0:
+			score = -MATE_SCORE if gs.checkmate else 0
+			return SearchResult(None, score, 0, [], 0, time.perf_counter() - start)
+
+		result = SearchResult(self.order_moves(root_moves, 0, None)[0], 0, 0, [], 0, 0.0)
+		pv = []
+		root_log_length = len(gs.move_log)
+		for depth in range(1, self.max_depth + 1):
+			try:
+				score = self.negamax(depth, 0, -INFINITY, INFINITY, pv)
+			except SearchTimeout:
+				while len(gs.move_log) > root_log_length: # unwind the moves of the cut off iteration
+					gs.undo_move()
+				break
+			pv = list(self.pv_table[0])
+			result = SearchResult(pv[0], score, depth, pv, self.nodes, time.perf_counter() - start)
+			if self.on_iteration is not None:
+				self.on_iteration(result)
+			if abs(score) >= MATE_SCORE - self.max_depth: # forced mate found, deeper will not change it
+				break
+		result.nodes = self.nodes
+		result.seconds = time.perf_counter() - start
+		result.nps = result.nodes / result.seconds if result.seconds else 0.0
+		return result
+
+	def negamax(self, depth, ply, alpha, beta, pv):
+		gs = self.gs
+		self.nodes += 1
+		if self.nodes % CHECK_EVERY == 0:
+			self.check_limits()
+		self.pv_table[ply] = []
+		if ply > 0 and (gs.halfmove_clock >= 100 or gs.is_repetition()): # a repeat inside the tree is scored as a draw
+			return 0
+		if self.tablebases is not None and ply > 0 and self.pieces <= MAX_TABLEBASE_PIECES:
+			result = self.tablebases.probe(gs)
+			if result is not None:
+				wdl, dtm = result
+				return 0 if wdl == 0 else wdl * (MATE_SCORE - ply - dtm)
+		if depth == 0:
+			return gs.evaluate() # incremental, constant time
+		moves = gs.get_valid_move()
+		if len(moves) == 0:
+			return -MATE_SCORE + ply if gs.checkmate else 0
+
+		pv_move = pv[ply] if ply < len(pv) else None
+		best_score = -INFINITY
+		for move in self.order_moves(moves, ply, pv_move):
+			captured = move.piece_captured != '--'
+			gs.make_move(move)
+			self.pieces -= captured
+			score = -self.negamax(depth - 1, ply + 1, -beta, -alpha, pv if move == pv_move else ())
+			gs.undo_move()
+			self.pieces += captured
+			if score > best_score:
+				best_score = score
+			if score > alpha:
+				alpha = score
+				self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+			if alpha >= beta:
+				if move.piece_captured == '--': # quiet move refuted the line, remember it
+					killers = self.killers[ply]
+					if killers[0] != move:
+						killers[1] = killers[0]
+						killers[0] = move
+					key = (move.piece_moved, move.end_row, move.end_col)
+					self.history[key] = self.history.get(key, 0) + depth * depth
+				break
+		return best_score
+
+	def order_moves(self, moves, ply, pv_move):
+		'''
+		previous principal variation move, then captures most valuable victim first,
+		then killer moves, then quiet moves by history score
+		'''
+		killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+		history = self.history
+
+		def move_order(move):
+			if move == pv_move:
+				return 10000000
+			if move.piece_captured != '--':
+				return 1000000 + PIECE_VALUES[move.piece_captured[1]] * 10 - PIECE_VALUES[move.piece_moved[1]] // 10
+			if move == killers[0]:
+				return 900000
+			if move == killers[1]:
+				return 800000
+			return history.get((move.piece_moved, move.end_row, move.end_col), 0)
+
+		return sorted(moves, key=move_order, reverse=True)
+
+
+def find_best_move(gs, max_depth=64, time_limit=None, node_limit=None, on_iteration=None, tablebases=None):
+	'''
+	best move and principal variation for the side to move within the given budget,
+	without any budget max_depth decides how long it takes
+	'''
+	return Search(gs, max_depth, time_limit, node_limit, on_iteration, tablebases).search()
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from engine import START_FEN, GameState
+from move_cache import MoveCache
+import search
+
+
+'''
+many games behind one asyncio service. a line of json in, a line of json out:
+{"op": "new"} -> {"session": 1, ...}, then moves, move, undo, fen, best and close with "session".
+finished sessions hand their GameState back to a pool that resets it in place,
+and every pooled GameState shares one MoveCache, so positions common to many games
+(openings above all) are generated once
+'''
+SEARCH_TIME = 0.5 # default seconds for best
+MAX_SEARCH_TIME = 5.0 # a client cannot ask for more, so every search ends and frees its session
+MAX_SEARCH_DEPTH = 32
+
+
+def search_limit(request, name, default, maximum, types):
+	'''
+	positive number from request[name] capped at maximum, default when absent, ValueError for anything else
+	'''
+	value = request.get(name, default)
+	if isinstance(value, bool) or not isinstance(value, types) or not value > 0:
+		raise ValueError(f'{name} must be a positive {"integer" if types is int else "number"}, got {value!r}')
+	return min(value, maximum)
+
+
+class GameStatePool:
+	def __init__(self, max_idle=1024, move_cache=None):
+		self.max_idle = max_idle
+		self.move_cache = move_cache if move_cache is not None else MoveCache()
+		self.idle = []
+		self.created = 0
+		self.reused = 0
+
+	def acquire(self, fen=START_FEN):
+		if self.idle:
+			gs = self.idle.pop()
+			self.reused += 1
+		else:
+			gs = GameState(self.move_cache)
+			self.created += 1
+		try:
+			if fen == START_FEN:
+				gs.reset() # in place, no parsing
+			else:
+				gs.load_fen(fen)
+		except ValueError:
+			self.release(gs)
+			raise
+		return gs
+
+	def release(self, gs):
+		if len(self.idle) < self.max_idle:
+			self.idle.append(gs)
+
+
+class Session:
+	def __init__(self, session_id, gs):
+		self.session_id = session_id
+		self.gs = gs
+		self.valid_move = None # legal moves of the current position, None until asked for
+		self.by_notation = None
+		self.busy = False # a search is running on gs in a worker thread
+
+	def moves(self):
+		if self.valid_move is None:
+			self.valid_move = self.gs.get_valid_move()
+			self.by_notation = {move.get_chess_notation(): move for move in self.valid_move}
+		return self.valid_move
+
+	def changed(self):
+		self.valid_move = None
+		self.by_notation = None
+
+	def state(self):
+		gs = self.gs
+		self.moves() # game end flags come with move generation
+		return {
+			'session': self.session_id,
+			'fen': gs.get_fen(),
+			'checkmate': gs.checkmate,
+			'stalemate': gs.stalemate,
+			'threefold_repetition': gs.threefold_repetition,
+			'fifty_move_draw': gs.fifty_move_draw,
+		}
+
+
+class SessionManager:
+	def __init__(self, pool=None):
+		self.pool = pool if pool is not None else GameStatePool()
+		self.sessions = {}
+		self.ids = itertools.count(1)
+		self.requests = 0
+
+	async def handle(self, request, owned=None):
+		'''
+		answer one request dict, errors come back as {"error": ...} instead of raising.
+		owned collects the sessions a connection opened so they are closed when it drops
+		'''
+		self.requests += 1
+		if not isinstance(request, dict):
+			return {'error': 'request must be a json object'}
+		op = request.get('op')
+		try:
+			if op == 'new':
+				fen = request.get('fen', START_FEN)
+				if not isinstance(fen, str): # checked before a GameState leaves the pool
+					return {'error': f'fen must be a string, not {fen!r}'}
+				session = Session(next(self.ids), None)
+				session.gs = self.pool.acquire(fen)
+				self.sessions[session.session_id] = session
+				if owned is not None:
+					owned.add(session.session_id)
+				return session.state()
+			if op == 'stats':
+				cache = self.pool.move_cache
+				return {'sessions': len(self.sessions), 'requests': self.requests, 'created': self.pool.created,
+						'reused': self.pool.reused, 'idle': len(self.pool.idle), 'cache': cache.stats()}
+			session = self.sessions.get(request.get('session'))
+			if session is None:
+				return {'error': f'no session {request.get("session")!r}'}
+			if session.busy:
+				return {'error': 'search running'}
+			if op == 'moves':
+				return {'session': session.session_id, 'moves': [move.get_chess_notation() for move in session.moves()]}
+			if op == 'move':
+				session.moves()
+				move = session.by_notation.get(request.get('move'))
+				if move is None:
+					return {'error': f'illegal move {request.get("move")!r}'}
+				session.gs.make_move(move)
+				session.changed()
+				return session.state()
+			if op == 'undo':
+				if session.gs.move_log:
+					session.gs.undo_move()
+					session.changed()
+				return session.state()
+			if op == 'fen':
+				return session.state()
+			if op == 'best':
+				time_limit = search_limit(request, 'time', SEARCH_TIME, MAX_SEARCH_TIME, (int, float))
+				max_depth = search_limit(request, 'depth', MAX_SEARCH_DEPTH, MAX_SEARCH_DEPTH, int)
+				return await self.best(session, time_limit, max_depth)
+			if op == 'close':
+				self.close(session.session_id)
+				if owned is not None:
+					owned.discard(session.session_id)
+				return {'session': session.session_id, 'closed': True}
+			return {'error': f'unknown op {op!r}'}
+		except (ValueError, TypeError) as e:
+			return {'error': str(e)}
+
+	def close(self, session_id):
+		session = self.sessions.pop(session_id, None)
+		if session is not None and not session.busy: # a searching GameState is left to the garbage collector
+			self.pool.release(session.gs)
+
+	async def best(self, session, time_limit, max_depth):
+		'''
+		search on a worker thread so other sessions keep being served, the session is locked meanwhile
+		'''
+		gs = session.gs
+		session.busy = True
+		gs.move_cache = None # the shared cache is only touched from the event loop thread
+		try:
+			result = await asyncio.to_thread(search.find_best_move, gs, max_depth, time_limit)
+		finally:
+			gs.move_cache = self.pool.move_cache
+			session.busy = False
+		return {'session': session.session_id, 'best_move': result.best_move.get_chess_notation() if result.best_move else None,
+				'score': result.score, 'depth': result.depth, 'nodes': result.nodes}
+
+	async def serve_client(self, reader, writer):
+		owned = set()
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				try:
+					request = json.loads(line)
+				except ValueError:
+					response = {'error': 'bad json'}
+				else:
+					response = await self.handle(request, owned)
+					if isinstance(request, dict) and 'id' in request:
+						response['id'] = request['id']
+				writer.write(json.dumps(response).encode() + b'\n')
+				await writer.drain()
+		finally:
+			for session_id in owned: # client went away without closing its games
+				self.close(session_id)
+			writer.close()
+
+
+async def serve(host='127.0.0.1', port=8765, manager=None):
+	manager = manager if manager is not None else SessionManager()
+	server = await asyncio.start_server(manager.serve_client, host, port)
+	return server, manager
+
+
+async def client_game(host, port, plies, rng, latencies):
+	'''
+	one load generator connection: new game, random legal moves, close. latency of every request is recorded
+	'''
+	reader, writer = await asyncio.open_connection(host, port)
+
+	async def call(request):
+		start = time.perf_counter()
+		writer.write(json.dumps(request).encode() + b'\n')
+		await writer.drain()
+		response = json.loads(await reader.readline())
+		latencies.append(time.perf_counter() - start)
+		return response
+
+	session = (await call({'op': 'new'}))['session']
+	for _ in range(plies):
+		moves = (await call({'op': 'moves', 'session': session}))['moves']
+		if not moves:
+			break
+		state = await call({'op': 'move', 'session': session, 'move': rng.choice(moves)})
+		if state.get('threefold_repetition') or state.get('fifty_move_draw'):
+			break
+	await call({'op': 'close', 'session': session})
+	writer.close()
+	await writer.wait_closed()
+
+
+async def load_test(clients=200, plies=40, rounds=2, seed=0, host='127.0.0.1', port=0):
+	'''
+	clients concurrent games per round against a local server, returns throughput and latency numbers.
+	the later rounds run on recycled GameStates
+	'''
+	server, manager = await serve(host, port)
+	port = server.sockets[0].getsockname()[1]
+	rng = random.Random(seed)
+	report = []
+	async with server:
+		for round_number in range(rounds):
+			latencies = []
+			start = time.perf_counter()
+			await asyncio.gather(*(client_game(host, port, plies, random.Random(rng.random()), latencies) for _ in range(clients)))
+			seconds = time.perf_counter() - start
+			latencies.sort()
+			report.append({
+				'round': round_number + 1,
+				'requests': len(latencies),
+				'seconds': seconds,
+				'requests_per_second': len(latencies) / seconds,
+				'p50_ms': latencies[len(latencies) // 2] * 1000,
+				'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+				'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+				'created': manager.pool.created,
+				'reused': manager.pool.reused,
+			})
+	return report, manager
+
+
+def bench_construction(count=2000):
+	'''
+	seconds per GameState() against resetting a pooled one with load_fen and with reset
+	'''
+	start = time.perf_counter()
+	for _ in range(count):
+		GameState()
+	construct = (time.perf_counter() - start) / count
+	gs = GameState()
+	start = time.perf_counter()
+	for _ in range(count):
+		gs.load_fen(START_FEN)
+	load_fen = (time.perf_counter() - start) / count
+	start = time.perf_counter()
+	for _ in range(count):
+		gs.reset()
+	reset = (time.perf_counter() - start) / count
+	return construct, load_fen, reset
+
+
+def main():
+	parser = argparse.ArgumentParser(description='multi game session server')
+	commands = parser.add_subparsers(dest='command', required=True)
+	serve_parser = commands.add_parser('serve', help='run the json lines server')
+	serve_parser.add_argument('--host', default='127.0.0.1')
+	serve_parser.add_argument('--port', type=int, default=8765)
+	bench = commands.add_parser('bench', help='local load generator against an in-process server')
+	bench.add_argument('--clients', type=int, default=200)
+	bench.add_argument('--plies', type=int, default=40)
+	bench.add_argument('--rounds', type=int, default=2)
+	args = parser.parse_args()
+
+	if args.command == 'serve':
+		async def run():
+			server, _ = await serve(args.host, args.port)
+			async with server:
+				await server.serve_forever()
+		asyncio.run(run())
+	else:
+		construct, load_fen, reset = bench_construction()
+		print(f'GameState() {construct * 1e6:.1f} us, load_fen {load_fen * 1e6:.1f} us, reset {reset * 1e6:.1f} us')
+		report, manager = asyncio.run(load_test(args.clients, args.plies, args.rounds))
+		for row in report:
+			print(f'round {row["round"]}: {row["requests"]} requests in {row["seconds"]:.2f}s, {row["requests_per_second"]:.0f} req/s, '
+				  f'p50 {row["p50_ms"]:.2f}ms p95 {row["p95_ms"]:.2f}ms p99 {row["p99_ms"]:.2f}ms, '
+				  f'GameStates created {row["created"]} reused {row["reused"]}')
+		print(f'move cache: {manager.pool.move_cache.stats()}')
+
+
+if __name__ == '__main__':
+	main()
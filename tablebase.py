@@ -0,0 +1,457 @@
+import argparse
+import itertools
+import mmap
+import os
+import struct
+import time
+from array import array
+from engine import SQUARE_TUPLES, GameState
+import perft
+
+
+'''
+endgame tables for a few pieces, built by retrograde analysis over GameState move generation.
+a table covers one material signature like KQvK: one byte per (side to move, square of every piece),
+indexed side * 64**n + sum(square_i * 64**(n-1-i)) with the pieces in signature order, white first.
+byte 0 is a draw, 255 an illegal placement and anything else distance to mate in plies + 1,
+even distances lose for the side to move and odd ones win. captures and promotions leave the table
+and are looked up in the smaller tables, so those are built first. castling never applies and an
+en passant capture is not part of the index: probe gives up when one is possible, and signatures
+with pawns on both sides, where a double push could allow one, are not generated
+'''
+MAGIC = b'CTB1'
+HEADER = struct.Struct('>4s8sB') # magic, signature, piece count
+DRAW = 0
+ILLEGAL = 255
+MAX_PIECES = 4
+PIECE_ORDER = 'KQRBNP'
+EXTENSION = '.ctb'
+
+
+def piece_code(color, letter):
+	return color + ('p' if letter == 'P' else letter)
+
+
+def parse_signature(signature):
+	'''
+	'KRvKN' -> ['wK', 'wR', 'bK', 'bN']
+	'''
+	white, _, black = signature.upper().partition('V')
+	if not white.startswith('K') or not black.startswith('K') or any(letter not in PIECE_ORDER for letter in white + black):
+		raise ValueError(f'bad signature {signature!r}')
+	return [piece_code('w', letter) for letter in white] + [piece_code('b', letter) for letter in black]
+
+
+def side_string(codes):
+	return ''.join(sorted(('P' if code[1] == 'p' else code[1] for code in codes), key=PIECE_ORDER.index))
+
+
+def side_strength(side):
+	return len(side), [-PIECE_ORDER.index(letter) for letter in side]
+
+
+def signature_of(codes):
+	'''
+	(signature, flipped) for a set of piece codes, the stronger side is always white in a
+	signature so flipped says the colors have to be swapped to read the table
+	'''
+	white = side_string([code for code in codes if code[0] == 'w'])
+	black = side_string([code for code in codes if code[0] == 'b'])
+	if side_strength(black) > side_strength(white):
+		return f'{black}v{white}', True
+	return f'{white}v{black}', False
+
+
+def child_signatures(signature):
+	'''
+	signatures a capture or a promotion leads to, bare kings excluded
+	'''
+	pieces = parse_signature(signature)
+	children = set()
+	for i, code in enumerate(pieces):
+		if code[1] == 'K':
+			continue
+		rest = pieces[:i] + pieces[i+1:]
+		if len(rest) > 2:
+			children.add(signature_of(rest)[0])
+		if code[1] == 'p':
+			children.add(signature_of(rest + [code[0] + 'Q'])[0])
+	return sorted(children)
+
+
+def decode_value(value):
+	'''
+	table byte -> (1 win / 0 draw / -1 loss for the side to move, plies to mate), None for illegal
+	'''
+	if value == ILLEGAL:
+		return None
+	if value == DRAW:
+		return 0, None
+	dtm = value - 1
+	return (1 if dtm % 2 else -1), dtm
+
+
+class Tablebases:
+	'''
+	tables by signature, files in directory are memory mapped the first time they are needed
+	'''
+	def __init__(self, directory='tablebases'):
+		self.directory = directory
+		self.tables = {} # signature -> (bytes like, offset of the first value), mmap or a freshly generated bytearray
+		self.missing = set() # signatures without a file, so search does not stat the disk at every node
+		self.files = []
+
+	def close(self):
+		for f, data in self.files:
+			data.close()
+			f.close()
+		self.files = []
+		self.tables = {}
+		self.missing = set()
+
+	def path(self, signature):
+		return os.path.join(self.directory, signature + EXTENSION)
+
+	def table(self, signature):
+		'''
+		(values, offset) of signature, None when there is no such table
+		'''
+		table = self.tables.get(signature)
+		if table is None and signature not in self.missing:
+			if not os.path.exists(self.path(signature)):
+				self.missing.add(signature)
+				return None
+			f = open(self.path(signature), 'rb')
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			magic, stored, count = HEADER.unpack_from(data, 0)
+			if magic != MAGIC or stored.rstrip(b'\0').decode() != signature or len(data) != HEADER.size + 2 * 64 ** count:
+				data.close()
+				f.close()
+				raise ValueError(f'{self.path(signature)} is not a table for {signature}')
+			self.files.append((f, data))
+			table = self.tables[signature] = (data, HEADER.size)
+		return table
+
+	def save(self, signature, values):
+		os.makedirs(self.directory, exist_ok=True)
+		with open(self.path(signature), 'wb') as f:
+			f.write(HEADER.pack(MAGIC, signature.encode(), len(parse_signature(signature))))
+			f.write(values)
+
+	def lookup(self, placed, white_to_move):
+		'''
+		table byte for pieces given as [(code, square index)], kings only is a draw, None without a table
+		'''
+		if len(placed) == 2:
+			return DRAW
+		signature, flipped = signature_of([code for code, _ in placed])
+		table = self.table(signature)
+		if table is None:
+			return None
+		data, offset = table
+		if flipped: # mirror the board and swap colors
+			placed = [(('b' if code[0] == 'w' else 'w') + code[1], (7 - sq // 8) * 8 + sq % 8) for code, sq in placed]
+			white_to_move = not white_to_move
+		squares = {}
+		for code, sq in placed:
+			squares.setdefault(code, []).append(sq)
+		index = 0
+		for code in parse_signature(signature):
+			index = index * 64 + squares[code].pop()
+		return data[offset + (index if white_to_move else 64 ** len(placed) + index)]
+
+	def probe(self, gs):
+		'''
+		(1 win / 0 draw / -1 loss, plies to mate) for the side to move of gs, None when the
+		position is not covered: too many pieces, castling rights, an en passant capture or no table
+		'''
+		if gs.current_castling_right.to_bits() or gs.zobrist_enpassant_col() is not None:
+			return None
+		placed = []
+		for row in range(8):
+			for col, piece in enumerate(gs.board[row]):
+				if piece != '--':
+					placed.append((piece, row * 8 + col))
+					if len(placed) > MAX_PIECES:
+						return None
+		value = self.lookup(placed, gs.white_to_move)
+		return decode_value(value) if value is not None else None
+
+	def best_move(self, gs):
+		'''
+		the legal move that wins fastest, else draws, else loses slowest, None without a table
+		'''
+		best = best_key = None
+		for move in gs.get_valid_move():
+			gs.make_move(move)
+			result = self.probe(gs)
+			gs.undo_move()
+			if result is None:
+				return None
+			wdl, dtm = result # from the opponent's side
+			key = (-wdl, -dtm if wdl < 0 else (dtm or 0))
+			if best_key is None or key > best_key:
+				best, best_key = move, key
+		return best
+
+	def generate(self, signature, progress=None):
+		'''
+		build the table for signature and every smaller table it needs, saving each to directory
+		'''
+		for child in child_signatures(signature):
+			if self.table(child) is None:
+				self.generate(child, progress)
+		values = generate_table(signature, self, progress)
+		self.save(signature, values)
+		self.tables[signature] = (values, 0)
+		self.missing.discard(signature)
+		return values
+
+
+def square_symmetries():
+	'''
+	square maps of the eight board symmetries, identity and file mirror first. without castling or en passant
+	move generation is the same under the file mirror, and under all eight when there are no pawns
+	'''
+	symmetries = []
+	for transpose in (False, True):
+		for flip_rows in (False, True):
+			for flip_cols in (False, True):
+				symmetry = []
+				for sq in range(64):
+					row, col = divmod(sq, 8)
+					if transpose:
+						row, col = col, row
+					symmetry.append((7 - row if flip_rows else row) * 8 + (7 - col if flip_cols else col))
+				symmetries.append(symmetry)
+	return symmetries
+
+
+SYMMETRIES = square_symmetries()
+
+
+def unmove_targets():
+	'''
+	letter -> square -> rays of squares a piece could have come from, nearest first, so sliders stop at
+	the first occupied square. knights and kings get a one square ray per step
+	'''
+	deltas = {
+		'N': ((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1)),
+		'K': ((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1)),
+		'R': ((-1,0), (0,-1), (1,0), (0,1)),
+		'B': ((-1,-1), (-1,1), (1,-1), (1,1)),
+	}
+	deltas['Q'] = deltas['R'] + deltas['B']
+	targets = {}
+	for letter, directions in deltas.items():
+		reach = 2 if letter in 'NK' else 8
+		targets[letter] = []
+		for sq in range(64):
+			row, col = divmod(sq, 8)
+			rays = []
+			for d_row, d_col in directions:
+				ray = [(row + d_row * i) * 8 + col + d_col * i for i in range(1, reach)
+					   if 0 <= row + d_row * i < 8 and 0 <= col + d_col * i < 8]
+				if ray:
+					rays.append(ray)
+			targets[letter].append(rays)
+	return targets
+
+
+UNMOVE_TARGETS = unmove_targets()
+
+
+def unmove_starts(code, sq, occupied):
+	'''
+	squares code could have moved to sq from without capturing or promoting, empty in the position after the move
+	'''
+	if code[1] == 'p':
+		step = 8 if code[0] == 'w' else -8 # white pawns move towards row 0, so they came from a higher row
+		start_row = 4 if code[0] == 'w' else 3 # where a double push lands
+		starts = []
+		if 1 <= sq // 8 + step // 8 <= 6 and sq + step not in occupied:
+			starts.append(sq + step)
+			if sq // 8 == start_row and sq + 2 * step not in occupied:
+				starts.append(sq + 2 * step)
+		return starts
+	starts = []
+	for ray in UNMOVE_TARGETS[code[1]][sq]:
+		for start in ray:
+			if start in occupied:
+				break
+			starts.append(start)
+	return starts
+
+
+def generate_table(signature, tablebases, progress=None):
+	'''
+	retrograde analysis. one legal placement per symmetry class is expanded with get_valid_move to count
+	its moves and score the ones that leave the table, then distances spread backwards level by level
+	from the mates: the positions a newly resolved one is reached from are found by un-moving its pieces,
+	so no move graph is stored, only a byte per index for the value, the moves still open and the
+	slowest loss through an exit
+	'''
+	pieces = parse_signature(signature)
+	count = len(pieces)
+	if count > MAX_PIECES:
+		raise ValueError(f'{signature} has more than {MAX_PIECES} pieces')
+	if any(code == 'wp' for code in pieces) and any(code == 'bp' for code in pieces):
+		raise ValueError(f'{signature}: pawns on both sides need en passant, which the index does not hold')
+	size = 64 ** count
+	weights = [64 ** (count - 1 - i) for i in range(count)]
+	values = bytearray([ILLEGAL]) * (2 * size)
+	remaining = bytearray(2 * size) # moves whose outcome is not yet known to lose for us
+	exit_loss = bytearray(2 * size) # level of the slowest loss among moves that leave the table
+	win_events = {} # level -> indexes with a move out of the table that wins on that level
+	loss_events = {} # level -> indexes lost on that level because of a slower losing exit
+	frontier = array('I') # indexes resolved on the current level
+
+	gs = GameState()
+	gs.load_fen('k7/8/8/8/8/8/8/7K w - - 0 1') # no castling or en passant, then clear the kings
+	board = gs.board
+	board[0][0] = board[7][7] = '--'
+	king_slots = [i for i, code in enumerate(pieces) if code[1] == 'K']
+	start = time.perf_counter()
+	# only the smallest index of every symmetry class is expanded, its result is written to all the images.
+	# the white king has the largest weight, so a smallest index starts on the smallest square of its orbit
+	symmetries = SYMMETRIES[:2] if any(code[1] == 'p' for code in pieces) else SYMMETRIES
+	first_squares = [sq for sq in range(64) if all(sq <= symmetry[sq] for symmetry in symmetries)]
+	for done, first in enumerate(first_squares):
+		if progress is not None:
+			progress(f'{signature}: first piece on {done}/{len(first_squares)} squares in {time.perf_counter() - start:.1f}s')
+		for offset, rest in enumerate(itertools.product(range(64), repeat=count - 1)):
+			squares = (first,) + rest
+			if len(set(squares)) < count or any(code[1] == 'p' and squares[i] // 8 in (0, 7) for i, code in enumerate(pieces)):
+				continue
+			base = first * weights[0] + offset
+			images = {sum(symmetry[sq] * weight for sq, weight in zip(squares, weights)) for symmetry in symmetries}
+			if min(images) < base:
+				continue
+			for i, code in enumerate(pieces):
+				board[squares[i] // 8][squares[i] % 8] = code
+			gs.white_king_location = SQUARE_TUPLES[squares[king_slots[0]]]
+			gs.black_king_location = SQUARE_TUPLES[squares[king_slots[1]]]
+			for side, color in ((0, 'w'), (1, 'b')):
+				gs.white_to_move = side == 0
+				opponent_king = gs.black_king_location if side == 0 else gs.white_king_location
+				if gs.is_square_attacked(opponent_king[0], opponent_king[1], color):
+					continue # side not to move is in check
+				moves = gs.get_valid_move()
+				if not moves:
+					for image in images:
+						values[side * size + image] = 1 if gs.checkmate else DRAW
+						if gs.checkmate:
+							frontier.append(side * size + image)
+					continue
+				open_moves = len(moves)
+				win_level = slowest_loss = 0
+				for move in moves:
+					if move.piece_captured == '--' and not move.is_pawn_promotion:
+						continue
+					start_sq = move.start_row * 8 + move.start_col
+					end_sq = move.end_row * 8 + move.end_col
+					moved = squares.index(start_sq)
+					captured = squares.index(end_sq) if move.piece_captured != '--' else None
+					placed = [(piece_code(code[0], 'Q') if i == moved and move.is_pawn_promotion else code, end_sq if i == moved else squares[i])
+							  for i, code in enumerate(pieces) if i != captured]
+					value = tablebases.lookup(placed, side == 1)
+					if value is None:
+						raise ValueError(f'missing table for {signature_of([code for code, _ in placed])[0]}')
+					if value == DRAW:
+						continue # stays open for good
+					dtm = value - 1
+					if dtm % 2 == 0: # the opponent is lost after it
+						win_level = dtm + 1 if not win_level else min(win_level, dtm + 1)
+					else:
+						open_moves -= 1
+						slowest_loss = max(slowest_loss, dtm + 1)
+				for image in images:
+					index = side * size + image
+					values[index] = DRAW
+					remaining[index] = open_moves
+					exit_loss[index] = slowest_loss
+					if win_level:
+						win_events.setdefault(win_level, array('I')).append(index)
+					elif not open_moves: # every move leaves the table and loses
+						loss_events.setdefault(slowest_loss, array('I')).append(index)
+			for i in range(count):
+				board[squares[i] // 8][squares[i] % 8] = '--'
+
+	colors = [code[0] for code in pieces]
+	level = 1
+	while frontier or any(key >= level for key in win_events) or any(key >= level for key in loss_events):
+		if level + 1 >= ILLEGAL:
+			raise ValueError(f'{signature}: distance to mate does not fit a byte')
+		resolved = array('I')
+		for successor in frontier:
+			successor_lost = values[successor] % 2 == 1 # dtm + 1 is odd when the side to move there is lost
+			side, base = divmod(successor, size)
+			squares = []
+			rest = base
+			for weight in weights:
+				sq, rest = divmod(rest, weight)
+				squares.append(sq)
+			occupied = set(squares)
+			mover = 'b' if side == 0 else 'w'
+			before = (1 - side) * size + base
+			for i, code in enumerate(pieces):
+				if colors[i] != mover:
+					continue
+				sq = squares[i]
+				for start_sq in unmove_starts(code, sq, occupied):
+					index = before + (start_sq - sq) * weights[i]
+					if values[index] != DRAW:
+						continue # illegal or already resolved
+					if not successor_lost:
+						remaining[index] -= 1
+						if remaining[index]:
+							continue
+						if exit_loss[index] > level: # a move out of the table holds out longer
+							loss_events.setdefault(exit_loss[index], array('I')).append(index)
+							continue
+					values[index] = level + 1
+					resolved.append(index)
+		for events in (win_events, loss_events):
+			for index in events.pop(level, ()):
+				if values[index] == DRAW:
+					values[index] = level + 1
+					resolved.append(index)
+		frontier = resolved
+		level += 1
+	if progress is not None:
+		progress(f'{signature}: done in {time.perf_counter() - start:.1f}s, longest mate {level - 2} plies')
+	return values
+
+
+def main():
+	parser = argparse.ArgumentParser(description='generate and probe endgame tables')
+	parser.add_argument('--dir', default='tablebases')
+	commands = parser.add_subparsers(dest='command', required=True)
+	generate = commands.add_parser('generate', help='build tables and the smaller ones they need')
+	generate.add_argument('signatures', nargs='+', help='like KQvK KRvK KPvK')
+	probe = commands.add_parser('probe', help='result and best move for a position')
+	probe.add_argument('fen')
+	probe.add_argument('--moves', default='', help='coordinate moves to play first')
+	args = parser.parse_args()
+
+	tablebases = Tablebases(args.dir)
+	if args.command == 'generate':
+		for signature in args.signatures:
+			tablebases.generate(signature, print)
+	else:
+		gs = GameState()
+		gs.load_fen(args.fen)
+		perft.play_moves(gs, args.moves)
+		result = tablebases.probe(gs)
+		if result is None:
+			print('not in the tables')
+		else:
+			wdl, dtm = result
+			best = tablebases.best_move(gs)
+			print(f'{("loss", "draw", "win")[wdl + 1]}' + (f' mate in {dtm} plies' if dtm is not None else '') +
+				  (f', best move {best.get_chess_notation()}' if best is not None else ''))
+	tablebases.close()
+
+
+if __name__ == '__main__':
+	main()
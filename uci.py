@@ -0,0 +1,282 @@
+import argparse
+import random
+import sys
+import threading
+import time
+from book import OpeningBook
+from engine import START_FEN, GameState
+import search
+
+
+'''
+UCI front end. the input loop stays on the main thread and search runs on a worker thread,
+so isready and stop are answered while a search is going. only the commands a gui needs
+to play games are handled: uci, isready, ucinewgame, position, go, stop and quit
+'''
+ENGINE_NAME = 'chess'
+ENGINE_AUTHOR = 'Natcha Phonkamhaeng'
+DEFAULT_MOVES_TO_GO = 30 # assumed moves left when the gui sends only the clock
+MOVE_OVERHEAD = 0.05 # seconds kept back for communication lag
+MIN_TIME = 0.01
+FIXED_TIME = 2.0 # seconds per move when go gives no clock for the side to move and no depth or nodes
+
+
+def uci_notation(move):
+	'''
+	coordinate notation with the promotion piece, pawns always promote to a queen here
+	'''
+	return move.get_chess_notation() + ('q' if move.is_pawn_promotion else '')
+
+
+def uci_score(score):
+	if abs(score) >= search.MATE_SCORE - 1000:
+		plies = search.MATE_SCORE - abs(score)
+		return f'mate {(plies + 1) // 2 if score > 0 else -((plies + 1) // 2)}'
+	return f'cp {score}'
+
+
+def think_time(wtime, btime, winc, binc, movestogo, white_to_move):
+	'''
+	seconds to spend on this move from the go clock fields (milliseconds), a fixed budget
+	when only the other side's clock was sent
+	'''
+	remaining = wtime if white_to_move else btime
+	if remaining is None:
+		return FIXED_TIME
+	increment = (winc if white_to_move else binc) or 0
+	budget = remaining / (movestogo or DEFAULT_MOVES_TO_GO) + increment * 0.75
+	budget = min(budget, remaining - MOVE_OVERHEAD * 1000)
+	return max(budget / 1000, MIN_TIME)
+
+
+class UciEngine:
+	def __init__(self, out=sys.stdout, book=None):
+		self.out = out
+		self.book = book # OpeningBook, moves from it are played without searching
+		self.rng = random.Random()
+		self.output_lock = threading.Lock()
+		self.gs = GameState()
+		self.searcher = None
+		self.thread = None
+		self.stopped = threading.Event() # set by stop, an infinite search holds its bestmove until then
+
+	def send(self, line):
+		with self.output_lock:
+			self.out.write(line + '\n')
+			self.out.flush()
+
+	def handle(self, line):
+		'''
+		run one line from the gui, returns False on quit
+		'''
+		tokens = line.split()
+		if not tokens:
+			return True
+		command, args = tokens[0], tokens[1:]
+		if command == 'uci':
+			self.send(f'id name {ENGINE_NAME}')
+			self.send(f'id author {ENGINE_AUTHOR}')
+			self.send('uciok')
+		elif command == 'isready':
+			self.send('readyok')
+		elif command == 'ucinewgame':
+			self.stop()
+			self.gs.load_fen(START_FEN)
+		elif command == 'position':
+			self.stop()
+			self.position(args)
+		elif command == 'go':
+			self.stop()
+			self.go(args)
+		elif command == 'stop':
+			self.stop()
+		elif command == 'quit':
+			self.stop()
+			return False
+		return True # unknown commands are ignored, as the protocol asks
+
+	def position(self, args):
+		if 'moves' in args:
+			index = args.index('moves')
+			args, moves = args[:index], args[index + 1:]
+		else:
+			moves = []
+		if args and args[0] == 'fen':
+			fen = ' '.join(args[1:])
+		else:
+			fen = START_FEN
+		try:
+			self.gs.load_fen(fen)
+			for notation in moves:
+				self.play(notation)
+		except ValueError as e:
+			self.send(f'info string {e}')
+
+	def play(self, notation):
+		notation = notation[:4] # promotion piece is always a queen
+		for move in self.gs.get_valid_move():
+			if move.get_chess_notation() == notation:
+				self.gs.make_move(move)
+				return
+		raise ValueError(f'illegal move {notation}')
+
+	def go(self, args):
+		fields = {}
+		infinite = False
+		i = 0
+		while i < len(args):
+			if args[i] == 'infinite':
+				infinite = True
+			elif args[i] in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes') and i + 1 < len(args):
+				try:
+					fields[args[i]] = int(args[i + 1])
+				except ValueError: # reported and left out, like any other input we do not understand
+					self.send(f'info string ignoring {args[i]} {args[i + 1]}')
+				i += 1
+			i += 1
+		if self.book is not None and not infinite:
+			move = self.book.choose(self.gs, self.rng)
+			if move is not None:
+				self.send('info string book move')
+				self.send(f'bestmove {uci_notation(move)}')
+				return
+		if infinite:
+			time_limit = None
+		elif 'movetime' in fields:
+			time_limit = fields['movetime'] / 1000
+		elif 'wtime' in fields or 'btime' in fields:
+			time_limit = think_time(fields.get('wtime'), fields.get('btime'), fields.get('winc'), fields.get('binc'),
+									fields.get('movestogo'), self.gs.white_to_move)
+		elif 'depth' in fields or 'nodes' in fields:
+			time_limit = None
+		else: # a bare go would otherwise search until depth 64
+			time_limit = FIXED_TIME
+		self.stopped.clear()
+		self.searcher = search.Search(self.gs, fields.get('depth', 64), time_limit, fields.get('nodes'), self.info)
+		self.thread = threading.Thread(target=self.think, args=(self.searcher, infinite), daemon=True)
+		self.thread.start()
+
+	def think(self, searcher, infinite):
+		result = searcher.search()
+		if infinite: # a mate or the depth limit can end the search early, the gui still expects bestmove after stop
+			self.stopped.wait()
+		self.send(f'bestmove {uci_notation(result.best_move) if result.best_move is not None else "0000"}')
+
+	def info(self, result):
+		self.send(f'info depth {result.depth} score {uci_score(result.score)} nodes {result.nodes} '
+				  f'nps {result.nps:.0f} time {result.seconds * 1000:.0f} pv {" ".join(uci_notation(move) for move in result.pv)}')
+
+	def stop(self):
+		'''
+		end a running search, it answers with bestmove before this returns
+		'''
+		if self.thread is not None:
+			self.stopped.set()
+			self.searcher.stop()
+			self.thread.join()
+			self.thread = None
+			self.searcher = None
+
+
+class ScriptedGui:
+	'''
+	stand-in for a gui: the engine writes into it, and the check waits on the lines that come back
+	'''
+	def __init__(self):
+		self.lines = []
+		self.condition = threading.Condition()
+
+	def write(self, text):
+		with self.condition:
+			self.lines.extend(text.splitlines())
+			self.condition.notify_all()
+
+	def flush(self):
+		pass
+
+	def wait_for(self, prefix, timeout, start=0):
+		'''
+		first line from index start on that begins with prefix, None when none came within timeout seconds
+		'''
+		def find():
+			return next((line for line in self.lines[start:] if line.startswith(prefix)), None)
+		with self.condition:
+			self.condition.wait_for(lambda: find() is not None, timeout)
+			return find()
+
+
+def check(timeout=5.0):
+	'''
+	drive UciEngine through a scripted gui session and check every answer: handshake, readyok while
+	an infinite search runs, bestmove only after stop even once a mate is found, a bounded search when
+	only the other side's clock is sent, and bad go fields and positions reported instead of raising. returns the seconds isready took during the search
+	'''
+	gui = ScriptedGui()
+	engine = UciEngine(out=gui)
+
+	def expect(line, prefix):
+		mark = len(gui.lines)
+		engine.handle(line)
+		answer = gui.wait_for(prefix, timeout, mark)
+		if answer is None:
+			raise AssertionError(f'no {prefix!r} after {line!r}: {gui.lines[mark:]}')
+		return answer
+
+	expect('uci', 'uciok')
+	expect('isready', 'readyok')
+	engine.handle('ucinewgame')
+	engine.handle('position startpos moves e2e4 e7e5')
+	mark = len(gui.lines)
+	engine.handle('go infinite')
+	if gui.wait_for('info depth', timeout, mark) is None:
+		raise AssertionError('go infinite did not start searching')
+	start = time.perf_counter()
+	expect('isready', 'readyok')
+	ready_seconds = time.perf_counter() - start
+	if gui.wait_for('bestmove', 0, mark) is not None:
+		raise AssertionError('bestmove before stop during go infinite')
+	best = expect('stop', 'bestmove').split()[1]
+	if best not in [move.get_chess_notation() for move in engine.gs.get_valid_move()]:
+		raise AssertionError(f'bestmove {best} is not legal')
+	engine.handle('position fen 6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1') # mate in one ends the search at once
+	mark = len(gui.lines)
+	engine.handle('go infinite')
+	if gui.wait_for('info depth', timeout, mark) is None:
+		raise AssertionError('go infinite did not start searching on the mate position')
+	if gui.wait_for('bestmove', 0.2, mark) is not None:
+		raise AssertionError('bestmove before stop after go infinite found a mate')
+	if expect('stop', 'bestmove').split()[1] != 'a1a8':
+		raise AssertionError('go infinite missed the mate in one')
+	engine.handle('position fen 4k3/8/8/8/8/8/4P3/4K3 b - - 0 1')
+	start = time.perf_counter()
+	expect('go wtime 60000', 'bestmove') # only white's clock with black to move
+	if time.perf_counter() - start > FIXED_TIME + 1:
+		raise AssertionError('go with only the other clock did not keep to the fixed budget')
+	engine.handle('position startpos')
+	expect('go depth x', 'info string ignoring depth x')
+	engine.stop()
+	best = expect('go depth 2', 'bestmove').split()[1]
+	expect('position fen 4k3/8/8/8/8/8/8/6K1 w K - 0 1', 'info string')
+	expect('position startpos moves e2e5', 'info string illegal move')
+	if engine.handle('quit'):
+		raise AssertionError('quit did not end the session')
+	return ready_seconds
+
+
+def main():
+	parser = argparse.ArgumentParser(description='UCI engine on stdin and stdout')
+	parser.add_argument('book', nargs='?', help='opening book file')
+	parser.add_argument('--check', action='store_true', help='run a scripted gui session against the engine and exit')
+	args = parser.parse_args()
+	if args.check:
+		print(f'scripted gui session ok, readyok during search after {check() * 1000:.2f}ms')
+		return
+	engine = UciEngine(book=OpeningBook(args.book) if args.book else None)
+	for line in sys.stdin:
+		if not engine.handle(line):
+			break
+	engine.stop()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,105 @@
+import queue
+import threading
+from engine import START_FEN, GameState
+from move_cache import MoveCache
+import search
+
+
+'''
+engine work off the ui thread. the ui submits jobs tagged with a generation number and polls a
+result queue every frame; cancel bumps the generation and stops a running search, so a result
+that belongs to a position the user already left by undo or reset is never handed out
+'''
+
+
+class Job:
+	def __init__(self, generation, kind, moves, max_depth=None, time_limit=None):
+		self.generation = generation
+		self.kind = kind # 'moves' or 'search'
+		self.moves = moves # Move objects played from the starting position
+		self.max_depth = max_depth
+		self.time_limit = time_limit
+
+
+class Result:
+	def __init__(self, generation, kind, valid_move, checkmate, stalemate, threefold_repetition, fifty_move_draw, best=None):
+		self.generation = generation
+		self.kind = kind
+		self.valid_move = valid_move
+		self.checkmate = checkmate
+		self.stalemate = stalemate
+		self.threefold_repetition = threefold_repetition
+		self.fifty_move_draw = fifty_move_draw
+		self.best = best # SearchResult for search jobs
+
+
+class EngineWorker:
+	def __init__(self, start_fen=START_FEN):
+		self.start_fen = start_fen
+		self.gs = GameState(MoveCache()) # only touched by the worker thread
+		self.jobs = queue.Queue()
+		self.results = queue.Queue()
+		self.lock = threading.Lock()
+		self.generation = 0
+		self.searcher = None
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def submit(self, kind, move_log, max_depth=None, time_limit=None):
+		'''
+		queue work for the position after move_log, the log is copied so the ui can go on moving
+		'''
+		with self.lock:
+			self.jobs.put(Job(self.generation, kind, list(move_log), max_depth, time_limit))
+
+	def cancel(self):
+		'''
+		drop every queued and running job, call on undo and reset before submitting the new position
+		'''
+		with self.lock:
+			self.generation += 1
+			if self.searcher is not None:
+				self.searcher.stop()
+
+	def poll(self):
+		'''
+		next result for the current generation without blocking, None when nothing is ready
+		'''
+		while True:
+			try:
+				result = self.results.get_nowait()
+			except queue.Empty:
+				return None
+			if result.generation == self.generation:
+				return result
+
+	def close(self):
+		self.cancel()
+		self.jobs.put(None)
+		self.thread.join()
+
+	def run(self):
+		gs = self.gs
+		while True:
+			job = self.jobs.get()
+			if job is None:
+				break
+			if job.generation != self.generation:
+				continue # cancelled while it waited
+			gs.load_fen(self.start_fen)
+			for move in job.moves: # replay so repetition history is there for the draw flags and search
+				gs.make_move(move)
+			valid_move = gs.get_valid_move()
+			flags = (gs.checkmate, gs.stalemate, gs.threefold_repetition, gs.fifty_move_draw) # search overwrites them
+			best = None
+			if job.kind == 'search' and valid_move:
+				with self.lock:
+					if job.generation != self.generation:
+						continue
+					self.searcher = search.Search(gs, job.max_depth or 64, job.time_limit)
+				try:
+					best = self.searcher.search()
+				finally:
+					with self.lock:
+						self.searcher = None
+			self.results.put(Result(job.generation, job.kind, valid_move, *flags, best))